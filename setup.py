@@ -11,11 +11,15 @@ with open("README.md", "r") as fh:
     long_description = fh.read()
 
 install_requires = [
-    "django>=2,<4",
+    "django>=3.1,<4",
     "zenpy>=2.0.11,<3",
     "django-konst>=2,<3",
 ]
 
+extras_require = {
+    "async": ["httpx>=0.18,<1"],
+}
+
 tests_require = [
     "pytest>=4,<5",
     "pytest-django>=3,<4",
@@ -30,7 +34,7 @@ setup(
     description=description,
     long_description=long_description,
     long_description_content_type="text/markdown",
-    version="2.0.4",
+    version="3.0.0",
     license="MIT",
     url=url,
     packages=find_packages(exclude=["tests", "testproj"]),
@@ -45,6 +49,7 @@ setup(
         "Framework :: Django",
     ],
     install_requires=install_requires,
+    extras_require=extras_require,
     test_suite="runtests.runtests",
     tests_require=tests_require,
     zip_safe=False,
@@ -231,6 +231,35 @@ submitter = json.loads(
 """
 )
 
+users_show_many = {
+    "users": [requester["user"], submitter["user"]],
+    "next_page": None,
+    "previous_page": None,
+    "count": 2,
+}
+
+incremental_tickets_first_page = {
+    "tickets": [
+        new_ticket["ticket"],
+        dict(new_ticket["ticket"], id=2, status="deleted"),
+    ],
+    "users": [requester["user"]],
+    "after_cursor": "MTU3",
+    "after_url": "https://example.zendesk.com/api/v2/incremental/tickets/cursor.json?cursor=MTU3",  # noqa
+    "before_cursor": None,
+    "before_url": None,
+    "end_of_stream": False,
+}
+
+incremental_tickets_last_page = {
+    "tickets": [],
+    "after_cursor": "MTU4",
+    "after_url": "https://example.zendesk.com/api/v2/incremental/tickets/cursor.json?cursor=MTU4",  # noqa
+    "before_cursor": "MTU3",
+    "before_url": None,
+    "end_of_stream": True,
+}
+
 no_comments = json.loads(
     r"""{
   "comments": [],
@@ -1,11 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from copy import copy
+from collections import Counter
+from copy import copy, deepcopy
+from datetime import timedelta
+from io import StringIO
 import json
-
-from django.core.exceptions import ValidationError
-
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connections
+from django.test import AsyncClient
+from django.utils import timezone
+
+from asgiref.sync import async_to_sync
 import dateutil
 
 
@@ -17,10 +29,21 @@ except ImportError:
 
 from model_mommy import mommy
 import pytest
+from requests.exceptions import HTTPError
 import responses
 
-from zengo import service, strings
-from zengo.models import Comment, Event, Ticket
+from zengo import aio, bulk, locks, pool, ratelimit, service, strings, views
+from zengo import client as zendesk_client
+from zengo.models import (
+    Attachment,
+    Comment,
+    Event,
+    Photo,
+    SyncCursor,
+    Ticket,
+    TicketLock,
+    ZendeskUser,
+)
 
 from . import api_responses
 
@@ -57,6 +80,15 @@ def add_api_responses(comments=None):
             status=200,
         )
     )
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=api_url_base + "users/show_many.json",
+            match_querystring=False,
+            json=api_responses.users_show_many,
+            status=200,
+        )
+    )
     responses.add(
         responses.Response(
             method="GET",
@@ -248,6 +280,29 @@ def test_processor_get_new_comments_existing_ticket_plus_comment(mocker):
     assert processor.get_new_comments(**update_context) == [another_comment]
 
 
+@responses.activate
+@pytest.mark.django_db
+def test_processor_get_updates_override(mocker):
+    add_api_responses(comments=api_responses.one_comment)
+    mommy.make("zengo.Ticket", zendesk_id=1, requester__zendesk_id=1)
+
+    class CustomProcessor(service.ZengoProcessor):
+        def get_new_comments(
+            self, pre_ticket, post_ticket, pre_comments, post_comments
+        ):
+            return ["custom"]
+
+    processor = CustomProcessor()
+    event = processor.store_event("""{"id": 1}""")
+    mocked_updated_signal = mocker.patch("zengo.signals.ticket_updated.send")
+    processor.process_event(event)
+
+    # overrides are passed only the ticket and its comments before and after
+    updates = mocked_updated_signal.call_args[1]["updates"]
+    assert updates["new_comments"] == ["custom"]
+    assert "subject" in updates["updated_fields"]
+
+
 @responses.activate
 @pytest.mark.django_db
 def test_processor_get_updated_fields_no_changes(mocker):
@@ -333,9 +388,9 @@ def test_webhook_view_no_body(client):
         reverse("webhook_view") + "?secret=zoomzoom", content_type="application/json"
     )
     assert response.status_code == 400
-    assert Event.objects.count() == 1
-    event = Event.objects.first()
-    assert event.raw_data == "{}"
+    assert response.content.decode("utf-8") == strings.data_no_ticket_id
+    # rejected before anything is stored
+    assert Event.objects.count() == 0
     assert Ticket.objects.count() == 0
 
 
@@ -351,14 +406,10 @@ def test_webhook_view_invalid_body(client):
         content_type="application/json",
     )
     assert response.status_code == 400
-    assert Event.objects.count() == 1
-    event = Event.objects.first()
-    assert event.raw_data == "iamnbotjosn.{}"
-    # no processing yet, so error is still none
-    assert event.error is None
-    # and the `json` property will be unhappy
-    with pytest.raises(ValueError):
-        event.json()
+    assert response.content.decode("utf-8") == strings.data_malformed
+    # rejected before anything is stored
+    assert Event.objects.count() == 0
+    assert Ticket.objects.count() == 0
 
 
 @responses.activate
@@ -377,6 +428,142 @@ def test_webhook_view_ok(client):
     assert Ticket.objects.count() == 1
 
 
+@pytest.mark.django_db
+def test_webhook_view_body_too_large(client, settings, django_assert_num_queries):
+    settings.ZENGO_WEBHOOK_MAX_BODY_SIZE = 10
+    with django_assert_num_queries(0):
+        response = client.post(
+            reverse("webhook_view") + "?secret=zoomzoom",
+            data=json.dumps({"ids": [1, 2, 3]}),
+            content_type="application/json",
+        )
+    assert response.status_code == 413
+    assert not Event.objects.exists()
+
+
+@pytest.mark.django_db
+def test_webhook_view_body_too_large_without_length(rf, settings):
+    settings.ZENGO_WEBHOOK_MAX_BODY_SIZE = 10
+    request = rf.post(
+        "/?secret=zoomzoom",
+        data=json.dumps({"ids": [1, 2, 3]}),
+        content_type="application/json",
+    )
+    # as for a chunked request
+    del request.META["CONTENT_LENGTH"]
+    response = views.WebhookView.as_view()(request)
+    assert response.status_code == 413
+    assert not Event.objects.exists()
+
+
+@pytest.mark.django_db
+def test_webhook_view_rejects_without_queries(client, django_assert_num_queries):
+    with django_assert_num_queries(0):
+        response = client.post(
+            reverse("webhook_view") + "?secret=face",
+            data=json.dumps({"id": 1}),
+            content_type="application/json",
+        )
+    assert response.status_code == 403
+    with django_assert_num_queries(0):
+        response = client.post(
+            reverse("webhook_view") + "?secret=zoomzoom",
+            data="iamnbotjosn.{}",
+            content_type="application/json",
+        )
+    assert response.status_code == 400
+
+
+def test_get_processor_resolves_class_once(settings, mocker):
+    settings.ZENGO_PROCESSOR_CLASS = "zengo.service.QueuedZengoProcessor"
+    service.import_attribute.cache_clear()
+    import_module = mocker.spy(service.importlib, "import_module")
+    assert isinstance(service.get_processor(), service.QueuedZengoProcessor)
+    assert isinstance(service.get_processor(), service.QueuedZengoProcessor)
+    assert import_module.call_count == 1
+
+
+def add_second_ticket_api_responses():
+    responses.add(
+        responses.GET,
+        api_url_base + "tickets/2.json",
+        json={"ticket": dict(api_responses.new_ticket["ticket"], id=2)},
+    )
+    responses.add(
+        responses.GET,
+        api_url_base + "tickets/2/comments.json",
+        json=api_responses.one_comment,
+    )
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_webhook_view_batch(client, mocker):
+    add_api_responses()
+    add_second_ticket_api_responses()
+    get_service = mocker.spy(service, "get_service")
+    response = client.post(
+        reverse("webhook_view") + "?secret=zoomzoom",
+        data=json.dumps({"ids": [1, "2"]}),
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    events = Event.objects.order_by("remote_ticket_id")
+    assert [(e.remote_ticket_id, e.json) for e in events] == [
+        (1, {"id": 1}),
+        (2, {"id": 2}),
+    ]
+    assert all(e.state == Event.states.processed for e in events)
+    assert Ticket.objects.count() == 2
+    # the events shared a service
+    assert get_service.call_count == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("ids", [[], "1", [1, "one"], None])
+def test_webhook_view_batch_invalid_ids(client, ids):
+    response = client.post(
+        reverse("webhook_view") + "?secret=zoomzoom",
+        data=json.dumps({"ids": ids}),
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+    assert response.content.decode("utf-8") == strings.data_no_ticket_ids
+    assert not Event.objects.exists()
+
+
+@pytest.mark.django_db
+def test_webhook_view_batch_too_large(client, settings):
+    settings.ZENGO_WEBHOOK_MAX_BATCH_SIZE = 2
+    response = client.post(
+        reverse("webhook_view") + "?secret=zoomzoom",
+        data=json.dumps({"ids": [1, 2, 3]}),
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+    assert not Event.objects.exists()
+
+
+@pytest.mark.django_db
+def test_processor_store_events_deduplicates_ids(settings):
+    settings.ZENGO_WEBHOOK_MAX_BATCH_SIZE = 2
+    events = service.ZengoProcessor().store_events(json.dumps({"ids": [2, 1, 2, "1"]}))
+    assert [e.remote_ticket_id for e in events] == [2, 1]
+
+
+@pytest.mark.django_db
+def test_processor_store_events_without_bulk_returning(mocker):
+    mocker.patch.object(
+        type(connections["default"].features),
+        "can_return_rows_from_bulk_insert",
+        new_callable=mocker.PropertyMock,
+        return_value=False,
+    )
+    events = service.ZengoProcessor().store_events(json.dumps({"ids": [1, 2]}))
+    assert all(e.pk for e in events)
+    assert Event.objects.count() == 2
+
+
 # test service methods
 
 
@@ -854,7 +1041,7 @@ def test_sync_user():
     assert local_zd_user.name == remote.name
     assert local_zd_user.active == remote.active
     assert local_zd_user.role == remote.role
-    assert json.loads(local_zd_user.photos_json) == remote.photo
+    assert local_zd_user.photos == remote.photo
 
 
 @responses.activate
@@ -867,13 +1054,13 @@ def test_sync_ticket():
 
     assert created
     assert local_ticket.zendesk_id == remote_ticket.id
-    assert local_ticket.requester.zendesk_id == remote_ticket.requester.id
+    assert local_ticket.requester.zendesk_id == remote_ticket.requester_id
     assert local_ticket.subject == remote_ticket.subject
     assert local_ticket.url == remote_ticket.url
     assert local_ticket.status == remote_ticket.status
     assert local_ticket.priority == remote_ticket.priority
-    assert json.loads(local_ticket.custom_fields) == remote_ticket.custom_fields
-    assert json.loads(local_ticket.tags) == remote_ticket.tags
+    assert local_ticket.custom_fields == remote_ticket.custom_fields
+    assert local_ticket.tags == remote_ticket.tags
     assert local_ticket.created_at == remote_ticket.created_at
     assert local_ticket.updated_at == remote_ticket.updated_at
 
@@ -1138,3 +1325,1178 @@ def test_get_special_zendesk_user():
     # and it will only be created once
     user_2 = service.ZengoService().get_special_zendesk_user()
     assert user.id == user_2.id
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_resync_updates_in_place():
+    add_api_responses(comments=api_responses.two_comments_with_attachments)
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+    comment_pks = set(local_ticket.comments.values_list("pk", flat=True))
+    attachment = Attachment.objects.get(zendesk_id=365692390412)
+    attachment.file_name = "stale.jpg"
+    attachment.fingerprint = None
+    attachment.save(update_fields=("file_name", "fingerprint"))
+
+    # syncing again should update rows rather than duplicate them
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+    assert not created
+    assert set(local_ticket.comments.values_list("pk", flat=True)) == comment_pks
+    assert Attachment.objects.count() == 4
+    assert Photo.objects.count() == 3
+    attachment.refresh_from_db()
+    assert attachment.file_name == "download.jpg"
+
+
+@pytest.mark.django_db
+def test_bulk_upsert():
+    ticket = mommy.make("zengo.Ticket")
+    author = mommy.make("zengo.ZendeskUser")
+    existing = mommy.make("zengo.Comment", zendesk_id=1, ticket=ticket, body="old")
+
+    def comment(zendesk_id, body):
+        return Comment(
+            zendesk_id=zendesk_id,
+            ticket=ticket,
+            author=author,
+            body=body,
+            public=True,
+            created_at=ticket.created_at,
+        )
+
+    pks = bulk.upsert(Comment, [comment(2, "new"), comment(1, "updated")])
+
+    assert pks[1] == existing.pk
+    assert Comment.objects.get(pk=pks[1]).body == "updated"
+    assert Comment.objects.get(pk=pks[2]).body == "new"
+    assert Comment.objects.count() == 2
+    assert bulk.upsert(Comment, []) == {}
+
+
+@pytest.mark.django_db
+def test_bulk_upsert_native(settings, mocker):
+    settings.ZENGO_UPSERT_BATCH_SIZE = 50
+    ticket = mommy.make("zengo.Ticket")
+    author = mommy.make("zengo.ZendeskUser")
+    existing = mommy.make("zengo.Comment", zendesk_id=1, ticket=ticket, body="old")
+    # as on Django 4.1 and later, where supported by the database
+    mocker.patch.object(bulk, "supports_native_upsert", return_value=True)
+
+    def fake_bulk_create(objs, **kwargs):
+        for obj in objs:
+            obj.pk = existing.pk if obj.zendesk_id == 1 else existing.pk + 1
+        return objs
+
+    bulk_create = mocker.patch(
+        "django.db.models.query.QuerySet.bulk_create", side_effect=fake_bulk_create
+    )
+    bulk_update = mocker.patch("django.db.models.query.QuerySet.bulk_update")
+    created, updated = [], []
+
+    pks = bulk.upsert(
+        Comment,
+        [
+            Comment(
+                zendesk_id=zendesk_id,
+                ticket=ticket,
+                author=author,
+                body="new",
+                public=True,
+                created_at=ticket.created_at,
+            )
+            for zendesk_id in (2, 1)
+        ],
+        created=created,
+        updated=updated,
+    )
+
+    # a single statement both inserts and updates, in a consistent order
+    bulk_create.assert_called_once()
+    args, kwargs = bulk_create.call_args
+    assert [o.zendesk_id for o in args[0]] == [1, 2]
+    assert kwargs == dict(
+        batch_size=50,
+        update_conflicts=True,
+        unique_fields=["zendesk_id"],
+        update_fields=bulk.get_update_fields(Comment, "zendesk_id"),
+    )
+    assert not bulk_update.called
+    assert pks == {1: existing.pk, 2: existing.pk + 1}
+    assert [o.zendesk_id for o in created] == [2]
+    assert [o.zendesk_id for o in updated] == [1]
+
+
+@pytest.mark.django_db
+def test_bulk_upsert_skips_unchanged_rows():
+    ticket = mommy.make("zengo.Ticket")
+    author = mommy.make("zengo.ZendeskUser")
+
+    def comments(body):
+        return [
+            Comment(
+                zendesk_id=zendesk_id,
+                ticket=ticket,
+                author=author,
+                body=body if zendesk_id == 2 else "same",
+                public=True,
+                created_at=ticket.created_at,
+            )
+            for zendesk_id in (1, 2)
+        ]
+
+    counter = Counter()
+    first_pks = bulk.upsert(Comment, comments("before"), counter=counter)
+    assert counter == {"comment": 2}
+
+    counter = Counter()
+    assert bulk.upsert(Comment, comments("after"), counter=counter) == first_pks
+    assert counter == {"comment": 1}
+    assert Comment.objects.get(zendesk_id=2).body == "after"
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_incremental_comments(settings):
+    settings.ZENGO_INCREMENTAL_COMMENT_SYNC = True
+    # the first sync sees one comment, the next sees both, newest first
+    add_api_responses(comments=api_responses.one_comment)
+    newest_first = deepcopy(api_responses.two_comments)
+    newest_first["comments"].reverse()
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=api_url_base + "tickets/1/comments.json",
+            match_querystring=False,
+            json=newest_first,
+            status=200,
+        )
+    )
+
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+    assert local_ticket.last_synced_comment_id == 1
+    assert local_ticket.comments_reconciled_at is not None
+    reconciled_at = local_ticket.comments_reconciled_at
+
+    # a local change to an already sync'd comment will not be overwritten
+    Comment.objects.filter(zendesk_id=1).update(body="untouched", fingerprint=None)
+
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+    comment_calls = [c for c in responses.calls if "comments.json" in c.request.url]
+    assert "sort=-created_at" in comment_calls[-1].request.url
+    assert local_ticket.last_synced_comment_id == 2
+    assert local_ticket.comments_reconciled_at == reconciled_at
+    assert local_ticket.comments.count() == 2
+    assert Comment.objects.get(zendesk_id=1).body == "untouched"
+
+    # once the reconcile interval has elapsed, the full history is fetched
+    settings.ZENGO_COMMENT_RECONCILE_INTERVAL = 0
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+    assert local_ticket.comments_reconciled_at > reconciled_at
+    assert Comment.objects.get(zendesk_id=1).body != "untouched"
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_incremental_comments_in_any_order(settings):
+    settings.ZENGO_INCREMENTAL_COMMENT_SYNC = True
+    add_api_responses(comments=api_responses.one_comment)
+    service.ZengoService().sync_ticket_id(1)
+
+    # should Zendesk not page newest first, older comments are skipped rather
+    # than ending the search for new ones
+    responses.reset()
+    add_api_responses(comments=api_responses.two_comments)
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+    assert local_ticket.last_synced_comment_id == 2
+    assert local_ticket.comments.count() == 2
+
+
+def test_client_session_shared_between_services(settings):
+    settings.ZENGO_CLIENT_POOL_SIZE = 3
+    zendesk_client.reset_sessions()
+    first, second = service.ZengoService(), service.ZengoService()
+    session = zendesk_client.get_session()
+    assert first.client.users.session is session
+    assert second.client.users.session is session
+    # object caches are never shared, so stale tickets are never served
+    assert first.client.cache is not second.client.cache
+    assert session.get_adapter(api_url_base)._pool_maxsize == 3
+
+    zendesk_client.reset_sessions()
+    assert zendesk_client.get_session() is not session
+
+
+# test QueuedZengoProcessor and the worker
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_webhook_view_queued_processor_acknowledges(client, settings, mocker):
+    settings.ZENGO_PROCESSOR_CLASS = "zengo.service.QueuedZengoProcessor"
+    get_service = mocker.spy(service, "get_service")
+    response = client.post(
+        reverse("webhook_view") + "?secret=zoomzoom",
+        data=json.dumps({"id": 1}),
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    # stored for a worker, but not yet processed
+    event = Event.objects.get()
+    assert event.state == Event.states.pending
+    assert Ticket.objects.count() == 0
+    assert len(responses.calls) == 0
+    # nor was a service, and so Zendesk client, built
+    assert not get_service.called
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_queued_processor_process_next_event():
+    processor = service.QueuedZengoProcessor()
+    event = processor.store_event("""{"id": 1}""")
+    add_api_responses()
+
+    assert processor.process_next_event() == event
+    event.refresh_from_db()
+    assert event.state == Event.states.processed
+    assert event.claimed_at is not None
+    assert Ticket.objects.filter(zendesk_id=1).exists()
+
+    # nothing further to do
+    assert processor.process_next_event() is None
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_queued_processor_claim_event():
+    processor = service.QueuedZengoProcessor()
+    first = processor.store_event("""{"id": 1}""")
+    second = processor.store_event("""{"id": 2}""")
+
+    # events are claimed oldest first and only once
+    assert processor.claim_event() == first
+    assert processor.claim_event() == second
+    assert processor.claim_event() is None
+
+    # unless their worker seemingly died while processing them
+    Event.objects.filter(id=first.id).update(
+        claimed_at=timezone.now() - timedelta(hours=1)
+    )
+    assert processor.claim_event() == first
+
+
+@responses.activate
+@pytest.mark.django_db(transaction=True)
+def test_zengo_worker_command(settings):
+    settings.ZENGO_PROCESSOR_CLASS = "zengo.service.QueuedZengoProcessor"
+    processor = service.get_processor()
+    processor.store_event("""{"id": 1}""")
+    add_api_responses()
+
+    call_command("zengo_worker", "--burst", "--workers", "2")
+
+    assert Event.objects.get().state == Event.states.processed
+    assert Ticket.objects.filter(zendesk_id=1).exists()
+
+
+def test_zengo_worker_command_requires_queued_processor():
+    with pytest.raises(CommandError):
+        call_command("zengo_worker", "--burst")
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_queued_processor_coalesces_events(settings):
+    settings.ZENGO_COALESCE_WINDOW = 30
+    processor = service.QueuedZengoProcessor()
+    first = processor.store_event("""{"id": 1}""")
+    second = processor.store_event("""{"id": 1}""")
+    other_ticket = processor.store_event("""{"id": 2}""")
+    late = processor.store_event("""{"id": 1}""")
+    Event.objects.filter(id__in=[first.id, second.id, other_ticket.id]).update(
+        created_at=timezone.now() - timedelta(seconds=60)
+    )
+    Event.objects.filter(id=late.id).update(
+        created_at=timezone.now() - timedelta(seconds=10)
+    )
+
+    # the burst for ticket 1 is claimed as one event
+    assert processor.claim_event() == first
+    second.refresh_from_db()
+    assert second.state == Event.states.merged
+    assert second.merged_into == first
+    assert processor.claim_event() == other_ticket
+
+    # events beyond the window remain, debounced until the window passes
+    late.refresh_from_db()
+    assert late.state == Event.states.pending
+    assert processor.claim_event() is None
+
+
+# test ticket locks
+
+
+@pytest.mark.django_db
+def test_cache_ticket_lock(mocker):
+    waited = mocker.patch("zengo.signals.ticket_lock_waited.send")
+    lock = locks.CacheTicketLock()
+    with lock(1):
+        # a second lock on the same ticket times out, other tickets are free
+        with pytest.raises(locks.LockTimeout):
+            with locks.CacheTicketLock(timeout=0)(1):
+                pass
+        with locks.CacheTicketLock(timeout=0)(2):
+            pass
+    # and once released, the lock can be taken again
+    with locks.CacheTicketLock(timeout=0)(1):
+        pass
+
+    acquired = [c[1]["acquired"] for c in waited.call_args_list]
+    assert acquired == [True, False, True, True]
+    assert all(c[1]["wait_time"] >= 0 for c in waited.call_args_list)
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_row_ticket_lock(mocker):
+    add_api_responses()
+    lock = locks.RowTicketLock()
+    wait = mocker.spy(lock, "wait")
+    with lock(1):
+        assert TicketLock.objects.filter(remote_ticket_id=1).exists()
+        # the row is only locked by the transaction writing the ticket
+        assert not wait.called
+        service.ZengoService().sync_ticket_id(1)
+        wait.assert_called_once_with(1)
+    # and not by writes outside the lock's context
+    service.ZengoService().sync_ticket_id(1)
+    assert wait.call_count == 1
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_row_ticket_lock_skips_stale_writes():
+    add_api_responses()
+    zengo_service = service.ZengoService()
+
+    def remote_ticket(**data):
+        return zengo_service.client.tickets._object_mapping.object_from_json(
+            "ticket", dict(api_responses.new_ticket["ticket"], **data)
+        )
+
+    # two syncs fetch the ticket as it changes from solved to open, the one
+    # which fetched later writing first
+    stale = remote_ticket(status="solved")
+    fresh = remote_ticket(status="open", updated_at="2019-01-16T00:00:00Z")
+    lock = locks.RowTicketLock()
+    with lock(1):
+        zengo_service.sync_ticket(fresh, remote_comments=[], is_full_history=True)
+    with lock(1):
+        result = zengo_service.sync_ticket(
+            stale, remote_comments=[], is_full_history=True
+        )
+
+    assert result.ticket.status == Ticket.states.open
+    assert result.changes.updated_fields == {}
+    assert Ticket.objects.get().status == Ticket.states.open
+
+
+@pytest.mark.django_db
+def test_advisory_ticket_lock_requires_postgres():
+    with pytest.raises(ImproperlyConfigured):
+        locks.AdvisoryTicketLock()
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_processor_acquires_configured_ticket_lock(settings, mocker):
+    settings.ZENGO_TICKET_LOCK_CLASS = "zengo.locks.CacheTicketLock"
+    processor = service.ZengoProcessor()
+    event = processor.store_event("""{"id": 1}""")
+    processor.process_event = mocker.Mock()
+
+    with locks.CacheTicketLock()(1):
+        settings.ZENGO_TICKET_LOCK_TIMEOUT = 0
+        with pytest.raises(locks.LockTimeout):
+            processor.process_event_and_record_errors(event)
+    assert event.state == Event.states.failed
+    assert not processor.process_event.called
+
+    processor.process_event_and_record_errors(event)
+    assert processor.process_event.called
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_resolves_users_in_one_request():
+    add_api_responses(comments=api_responses.two_comments)
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+
+    # comments are requested with their authors sideloaded
+    comment_calls = [c for c in responses.calls if "comments.json" in c.request.url]
+    assert "include=users" in comment_calls[0].request.url
+    # and the remaining two users are fetched together
+    user_calls = [c for c in responses.calls if "/users/" in c.request.url]
+    assert len(user_calls) == 1
+    assert "show_many.json" in user_calls[0].request.url
+    assert set(local_ticket.comments.values_list("author__zendesk_id", flat=True)) == {
+        1,
+        2,
+    }
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_get_remote_users_uses_sideloaded_users():
+    add_api_responses()
+    sideloaded = deepcopy(api_responses.two_comments)
+    sideloaded["users"] = [api_responses.submitter["user"]]
+    responses.replace(
+        responses.GET,
+        api_url_base + "tickets/1/comments.json",
+        json=sideloaded,
+    )
+    zengo_service = service.ZengoService()
+    zengo_service.get_remote_comments(zengo_service.client.tickets(id=1))
+    responses.calls.reset()
+
+    remote_users = zengo_service.get_remote_users([1, 2, 2])
+    assert sorted(remote_users) == [1, 2]
+    # only the user that wasn't sideloaded is fetched
+    assert len(responses.calls) == 1
+    assert "ids=1" in responses.calls[0].request.url
+
+
+@pytest.mark.django_db
+def test_get_local_users_for_external_ids(django_assert_num_queries):
+    first, second = mommy.make("auth.User", _quantity=2)
+    with django_assert_num_queries(1):
+        local_users = service.ZengoService().get_local_users_for_external_ids(
+            [first.id, str(second.id), 999999, None]
+        )
+    assert local_users == {
+        first.id: first,
+        str(second.id): second,
+        999999: None,
+        None: None,
+    }
+
+
+@pytest.mark.django_db
+def test_get_local_users_for_external_ids_respects_override():
+    user = mommy.make("auth.User")
+
+    class CustomService(service.ZengoService):
+        def get_local_user_for_external_id(self, external_id):
+            return user if external_id == "custom" else None
+
+    local_users = CustomService().get_local_users_for_external_ids(["custom", 1])
+    assert local_users == {"custom": user, 1: None}
+
+
+@pytest.mark.django_db
+def test_special_zendesk_user_cached_until_deleted(mocker, django_assert_num_queries):
+    mocker.patch.dict(service._special_zendesk_users)
+    # tests run within a transaction, so commit callbacks never run by themselves
+    mocker.patch.object(
+        service.transaction, "on_commit", side_effect=lambda func, using=None: func()
+    )
+    zengo_service = service.ZengoService()
+    special = zengo_service.get_special_zendesk_user()
+    assert special.zendesk_id == -1
+
+    with django_assert_num_queries(0):
+        assert service.ZengoService().get_special_zendesk_user() is special
+
+    special.delete()
+    recreated = zengo_service.get_special_zendesk_user()
+    assert recreated.zendesk_id == -1
+    assert recreated.pk != special.pk
+
+
+@responses.activate
+@pytest.mark.django_db(transaction=True)
+def test_special_zendesk_user_forgotten_once_deleted_elsewhere(mocker):
+    mocker.patch.dict(service._special_zendesk_users, clear=True)
+    add_api_responses(comments=api_responses.comment_with_no_author)
+    service.ZengoService().sync_ticket_id(1)
+    special = service._special_zendesk_users["default"]
+
+    # as if deleted by another process
+    Comment.objects.all().delete()
+    with connections["default"].cursor() as cursor:
+        cursor.execute("DELETE FROM zengo_zendeskuser WHERE id = %s", [special.pk])
+
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+    assert local_ticket.comments.get(author__zendesk_id=-1).author_id != special.pk
+
+
+@pytest.mark.django_db
+def test_special_zendesk_user_not_cached_before_commit(mocker):
+    mocker.patch.dict(service._special_zendesk_users, clear=True)
+    zengo_service = service.ZengoService()
+    special = zengo_service.get_special_zendesk_user()
+    assert service._special_zendesk_users == {}
+    assert zengo_service.get_special_zendesk_user() == special
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_skips_unchanged_rows():
+    add_api_responses(comments=api_responses.two_comments_with_attachments)
+    zengo_service = service.ZengoService()
+    zengo_service.sync_ticket_id(1)
+    assert zengo_service.write_counts == {
+        "zendeskuser": 2,
+        "ticket": 1,
+        "comment": 2,
+        "attachment": 4,
+        "photo": 3,
+        "tickettag": 3,
+        "ticketcustomfieldvalue": 2,
+    }
+
+    # a local change survives a resync, as the remote data hasn't changed
+    comment = Comment.objects.first()
+    Comment.objects.filter(pk=comment.pk).update(body="untouched")
+    zengo_service = service.ZengoService()
+    zengo_service.sync_ticket_id(1)
+    assert zengo_service.write_counts == {}
+    comment.refresh_from_db()
+    assert comment.body == "untouched"
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_incremental_skips_unchanged_ticket(settings):
+    settings.ZENGO_INCREMENTAL_COMMENT_SYNC = True
+    add_api_responses(comments=api_responses.one_comment)
+    service.ZengoService().sync_ticket_id(1)
+
+    # finding no new comments leaves the sync state, and so ticket, as it was
+    zengo_service = service.ZengoService()
+    local_ticket, created = zengo_service.sync_ticket_id(1)
+    assert zengo_service.write_counts == {}
+    assert local_ticket.last_synced_comment_id == 1
+
+    # while only the sync state is written once the history is reconciled
+    settings.ZENGO_COMMENT_RECONCILE_INTERVAL = 0
+    zengo_service = service.ZengoService()
+    zengo_service.sync_ticket_id(1)
+    assert zengo_service.write_counts == {"ticket": 1}
+    assert Ticket.objects.get().comments_reconciled_at > local_ticket.comments_reconciled_at
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_id_fetches_ticket_and_comments_concurrently():
+    comments_requested = threading.Event()
+    overlapped = []
+
+    def ticket_callback(request):
+        # only returns promptly if the comments are requested meanwhile
+        overlapped.append(comments_requested.wait(timeout=5))
+        return 200, {}, json.dumps(api_responses.new_ticket)
+
+    def comments_callback(request):
+        comments_requested.set()
+        return 200, {}, json.dumps(api_responses.one_comment)
+
+    responses.add_callback(
+        responses.GET, api_url_base + "tickets/1.json", callback=ticket_callback
+    )
+    responses.add_callback(
+        responses.GET,
+        api_url_base + "tickets/1/comments.json",
+        callback=comments_callback,
+    )
+    responses.add(
+        responses.GET,
+        api_url_base + "users/show_many.json",
+        json=api_responses.users_show_many,
+    )
+
+    local_ticket, created = service.ZengoService().sync_ticket_id(1)
+    assert overlapped == [True]
+    assert created
+    assert local_ticket.comments.count() == 1
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_id_fetches_ticket_with_service_client():
+    add_api_responses()
+    created_clients = []
+
+    class CustomService(service.ZengoService):
+        def create_client(self):
+            created_clients.append(zendesk_client.get_client())
+            return created_clients[-1]
+
+    local_ticket, created = CustomService().sync_ticket_id(1)
+    assert created
+    # one for the service, and one for fetching the ticket
+    assert len(created_clients) == 2
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_is_all_or_nothing(mocker):
+    add_api_responses(comments=api_responses.two_comments_with_attachments)
+    zengo_service = service.ZengoService()
+    upsert = bulk.upsert
+
+    def failing_upsert(model, *args, **kwargs):
+        if model is Photo:
+            # by now Zendesk is done with, and most rows are written
+            assert len(responses.calls) == 3
+            raise IntegrityError("boom")
+        return upsert(model, *args, **kwargs)
+
+    mocker.patch("zengo.bulk.upsert", side_effect=failing_upsert)
+    with pytest.raises(IntegrityError):
+        zengo_service.sync_ticket_id(1)
+
+    assert not Ticket.objects.exists()
+    assert not Comment.objects.exists()
+    assert not Attachment.objects.exists()
+    assert not ZendeskUser.objects.exists()
+    assert zengo_service.write_counts == {}
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_reports_changes():
+    add_api_responses(comments=api_responses.two_comments_with_attachments)
+    result = service.ZengoService().sync_ticket_id(1)
+    local_ticket, created = result
+    assert created
+    assert result.ticket == local_ticket
+    assert result.changes.updated_fields == {}
+    assert [c.zendesk_id for c in result.changes.new_comments] == [
+        583514996211,
+        584081472972,
+    ]
+    assert all(c.pk for c in result.changes.new_comments)
+    assert len(result.changes.new_attachments) == 4
+
+    changed_ticket = deepcopy(api_responses.new_ticket)
+    changed_ticket["ticket"]["subject"] = "Urgent maintenance request"
+    changed_ticket["ticket"]["status"] = "pending"
+    changed_comments = deepcopy(api_responses.two_comments_with_attachments)
+    changed_comments["comments"][1]["body"] = "Redacted"
+    responses.replace(
+        responses.GET, api_url_base + "tickets/1.json", json=changed_ticket
+    )
+    responses.replace(
+        responses.GET,
+        api_url_base + "tickets/1/comments.json",
+        json=changed_comments,
+    )
+    result = service.ZengoService().sync_ticket_id(1)
+    assert not result.created
+    assert result.changes.updated_fields == {
+        "subject": {"old": "Maintenance request", "new": "Urgent maintenance request"},
+        "status": {"old": Ticket.states.open, "new": Ticket.states.pending},
+    }
+    assert result.changes.new_comments == []
+    assert [c.zendesk_id for c in result.changes.updated_comments] == [584081472972]
+    assert result.changes.new_attachments == []
+    assert result.changes.updated_attachments == []
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_processor_process_event_uses_sync_changes(mocker):
+    add_api_responses(comments=api_responses.one_comment)
+    mommy.make(
+        "zengo.Ticket", zendesk_id=1, requester__zendesk_id=1, subject="Old subject"
+    )
+    processor = service.ZengoProcessor()
+    event = processor.store_event("""{"id": 1}""")
+    mocked_updated_signal = mocker.patch("zengo.signals.ticket_updated.send")
+    processor.process_event(event)
+
+    kwargs = mocked_updated_signal.call_args[1]
+    changes = kwargs["context"]["changes"]
+    assert kwargs["updates"]["new_comments"] == changes.new_comments
+    assert len(changes.new_comments) == 1
+    assert kwargs["updates"]["updated_fields"]["subject"] == {
+        "old": "Old subject",
+        "new": "Maintenance request",
+    }
+    assert kwargs["context"]["pre_comment_ids"] == set()
+    assert kwargs["context"]["post_comment_ids"] == {changes.new_comments[0].zendesk_id}
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_sync_ticket_tags_and_custom_field_values():
+    add_api_responses(comments=api_responses.one_comment)
+    zengo_service = service.ZengoService()
+    local_ticket, created = zengo_service.sync_ticket_id(1)
+    assert sorted(local_ticket.ticket_tags.values_list("name", flat=True)) == [
+        "follow_up_sent",
+        "maintenance",
+        "portland",
+    ]
+    kept_tag = local_ticket.ticket_tags.get(name="portland")
+    assert Ticket.objects.filter(
+        custom_field_values__field_id=1, custom_field_values__value="donkey"
+    ).exists()
+
+    changed = deepcopy(api_responses.new_ticket)
+    changed["ticket"]["tags"] = ["portland", "vip"]
+    changed["ticket"]["custom_fields"] = [
+        {"id": 1, "value": ["donkey", "mule"]},
+        {"id": 2, "value": None},
+        {"id": 3, "value": True},
+    ]
+    responses.replace(responses.GET, api_url_base + "tickets/1.json", json=changed)
+    zengo_service = service.ZengoService()
+    zengo_service.sync_ticket_id(1)
+
+    assert sorted(local_ticket.ticket_tags.values_list("name", flat=True)) == [
+        "portland",
+        "vip",
+    ]
+    # unchanged tags are left alone, rather than rewritten
+    assert local_ticket.ticket_tags.get(name="portland").pk == kept_tag.pk
+    assert sorted(
+        local_ticket.custom_field_values.values_list("field_id", "value")
+    ) == [(1, "donkey"), (1, "mule"), (3, "true")]
+    assert zengo_service.write_counts["tickettag"] == 3
+    assert zengo_service.write_counts["ticketcustomfieldvalue"] == 3
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_zengo_backfill_command():
+    add_api_responses(comments=api_responses.one_comment)
+    for page in (
+        api_responses.incremental_tickets_first_page,
+        api_responses.incremental_tickets_last_page,
+    ):
+        responses.add(
+            responses.GET,
+            api_url_base + "incremental/tickets/cursor.json",
+            json=page,
+        )
+
+    call_command("zengo_backfill", stdout=StringIO())
+
+    export_calls = [c for c in responses.calls if "incremental" in c.request.url]
+    assert "start_time=0" in export_calls[0].request.url
+    assert "include=users" in export_calls[0].request.url
+    assert "cursor=MTU3" in export_calls[1].request.url
+    # deleted tickets are skipped
+    assert list(Ticket.objects.values_list("zendesk_id", flat=True)) == [1]
+    assert SyncCursor.objects.get(name="tickets").cursor == "MTU4"
+
+    # a later run resumes from the checkpoint
+    responses.calls.reset()
+    responses.add(
+        responses.GET,
+        api_url_base + "incremental/tickets/cursor.json",
+        json=api_responses.incremental_tickets_last_page,
+    )
+    call_command("zengo_backfill", stdout=StringIO())
+    assert "cursor=MTU4" in responses.calls[0].request.url
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_zengo_backfill_command_holds_checkpoint_on_failure(mocker):
+    for page in (
+        api_responses.incremental_tickets_first_page,
+        api_responses.incremental_tickets_last_page,
+    ):
+        responses.add(
+            responses.GET,
+            api_url_base + "incremental/tickets/cursor.json",
+            json=page,
+        )
+    mocker.patch.object(
+        service.ZengoService, "sync_ticket", side_effect=ValueError("hoho")
+    )
+
+    with pytest.raises(CommandError):
+        call_command("zengo_backfill", stdout=StringIO())
+
+    # both pages were walked, but the failed ticket will be sync'd again
+    assert len(responses.calls) == 2
+    assert SyncCursor.objects.get(name="tickets").cursor is None
+
+
+def test_pool_partition():
+    assert pool.partition([5, 1, 4, 2, 3], 2) == [[1, 2], [3, 4], [5]]
+    assert pool.partition([], 2) == []
+
+
+@responses.activate
+@pytest.mark.django_db(transaction=True)
+def test_zengo_resync_command():
+    add_api_responses()
+    mommy.make("zengo.Ticket", zendesk_id=1, subject="stale")
+    out = StringIO()
+
+    call_command("zengo_resync", "--workers", "2", stdout=out)
+
+    assert Ticket.objects.get(zendesk_id=1).subject == "Maintenance request"
+    assert "Sync'd 1 tickets, 0 failed" in out.getvalue()
+
+
+def test_pool_sync_tickets_processes_require_ids():
+    with pytest.raises(ValueError):
+        pool.sync_tickets([object()], workers=2, processes=True)
+
+
+def test_token_bucket(mocker):
+    sleep = mocker.patch.object(ratelimit.time, "sleep")
+    bucket = ratelimit.TokenBucket(rate=10, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert not sleep.called
+
+    # the bucket is empty, so we wait for it to refill
+    sleep.side_effect = lambda seconds: setattr(
+        bucket._updated, "value", bucket._updated.value - seconds
+    )
+    bucket.acquire()
+    assert sleep.call_count == 1
+    assert sleep.call_args[0][0] == pytest.approx(0.1, abs=0.01)
+
+
+@responses.activate
+def test_client_requests_draw_from_rate_limiter(settings, mocker):
+    settings.ZENGO_RATE_LIMIT = 600
+    mocker.patch.object(ratelimit, "_limiter", None)
+    zendesk_client.reset_sessions()
+    limiter = ratelimit.get_rate_limiter()
+    assert limiter.rate == 10
+    acquire = mocker.patch.object(limiter, "acquire")
+    add_api_responses()
+
+    service.ZengoService().client.tickets(id=1)
+    assert acquire.call_count == 1
+
+
+@responses.activate
+def test_client_retries_rate_limited_requests(mocker):
+    mocker.patch.object(ratelimit, "_blocked_until", 0.0)
+    sleep = mocker.patch.object(ratelimit.time, "sleep")
+    responses.add(
+        responses.GET,
+        api_url_base + "tickets/1.json",
+        status=429,
+        headers={"Retry-After": "7"},
+    )
+    add_api_responses()
+
+    remote_ticket = service.ZengoService().client.tickets(id=1)
+
+    assert remote_ticket.id == 1
+    assert len(responses.calls) == 2
+    # the wait is jittered
+    assert 7 <= sleep.call_args[0][0] <= 7 * (1 + ratelimit.JITTER)
+
+
+@responses.activate
+def test_client_gives_up_retrying_rate_limited_requests(settings, mocker):
+    settings.ZENGO_RATE_LIMIT_RETRIES = 2
+    mocker.patch.object(ratelimit, "_blocked_until", 0.0)
+    sleep = mocker.patch.object(ratelimit.time, "sleep")
+    responses.add(responses.GET, api_url_base + "tickets/1.json", status=429)
+
+    with pytest.raises(HTTPError):
+        service.ZengoService().client.tickets(id=1)
+    assert len(responses.calls) == 3
+    # backing off exponentially without a Retry-After header
+    assert [c[0][0] // 1 for c in sleep.call_args_list] == [1, 2]
+
+
+@responses.activate
+def test_client_throttles_when_few_requests_remain(settings, mocker):
+    settings.ZENGO_RATE_LIMIT_CACHE = "default"
+    mocker.patch.object(ratelimit, "_blocked_until", 0.0)
+    responses.add(
+        responses.GET,
+        api_url_base + "tickets/1.json",
+        json=api_responses.new_ticket,
+        headers={"X-Rate-Limit-Remaining": "3", "ratelimit-reset": "20"},
+    )
+
+    service.ZengoService().client.tickets(id=1)
+
+    # the remaining requests are spread over the rest of the window, across
+    # all nodes sharing the cache
+    blocked_for = ratelimit._blocked_until - time.time()
+    assert 4 < blocked_for <= 5
+    assert caches["default"].get(ratelimit.BLOCKED_UNTIL_KEY) == pytest.approx(
+        ratelimit._blocked_until
+    )
+    caches["default"].delete(ratelimit.BLOCKED_UNTIL_KEY)
+
+
+@pytest.mark.django_db
+def test_processor_schedules_retries_of_failed_events(settings):
+    settings.ZENGO_RETRY_MAX_ATTEMPTS = 3
+    settings.ZENGO_RETRY_BACKOFF = 10
+    processor = service.ZengoProcessor()
+
+    def broken_process_event(event):
+        raise ValueError("hoho")
+
+    processor.process_event = broken_process_event
+    event = processor.store_event("""{"id": 1}""")
+
+    for attempt, delay in ((1, 10), (2, 20)):
+        before = timezone.now()
+        with pytest.raises(ValueError):
+            processor.process_event_and_record_errors(event)
+        event.refresh_from_db()
+        assert event.state == Event.states.failed
+        assert event.attempts == attempt
+        assert event.last_error_class == "builtins.ValueError"
+        assert event.next_attempt_at - before >= timedelta(seconds=delay)
+        assert event.next_attempt_at - before < timedelta(seconds=delay + 1)
+
+    # the final attempt dead-letters the event
+    with pytest.raises(ValueError):
+        processor.process_event_and_record_errors(event)
+    event.refresh_from_db()
+    assert event.state == Event.states.dead
+    assert event.next_attempt_at is None
+
+
+@pytest.mark.django_db
+def test_processor_retry_succeeding_clears_error(mocker):
+    processor = service.ZengoProcessor()
+    event = processor.store_event("""{"id": 1}""")
+
+    mocker.patch.object(processor, "process_event", side_effect=ValueError("hoho"))
+    with pytest.raises(ValueError):
+        processor.process_event_and_record_errors(event)
+
+    mocker.patch.object(processor, "process_event")
+    processor.process_event_and_record_errors(event)
+    event.refresh_from_db()
+    assert event.state == Event.states.processed
+    assert event.attempts == 2
+    assert event.error is None
+    assert event.last_error_class is None
+    assert "Processed" in str(event)
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_zengo_retry_events_command():
+    add_api_responses()
+    due = mommy.make(
+        "zengo.Event",
+        remote_ticket_id=1,
+        state=Event.states.failed,
+        attempts=1,
+        next_attempt_at=timezone.now() - timedelta(seconds=1),
+    )
+    not_due = mommy.make(
+        "zengo.Event",
+        remote_ticket_id=1,
+        state=Event.states.failed,
+        attempts=1,
+        next_attempt_at=timezone.now() + timedelta(hours=1),
+    )
+    out = StringIO()
+
+    call_command("zengo_retry_events", stdout=out)
+
+    assert "Retried 1 events" in out.getvalue()
+    due.refresh_from_db()
+    assert due.state == Event.states.processed
+    assert due.attempts == 2
+    assert due.next_attempt_at is None
+    not_due.refresh_from_db()
+    assert not_due.state == Event.states.failed
+
+
+@responses.activate
+@pytest.mark.django_db
+def test_processor_retries_abandoned_events():
+    add_api_responses()
+    claimed_at = timezone.now() - timedelta(minutes=11)
+    abandoned = mommy.make(
+        "zengo.Event",
+        remote_ticket_id=1,
+        state=Event.states.processing,
+        attempts=1,
+        claimed_at=claimed_at,
+    )
+    in_progress = mommy.make(
+        "zengo.Event",
+        remote_ticket_id=1,
+        state=Event.states.processing,
+        attempts=1,
+        claimed_at=timezone.now(),
+    )
+
+    assert service.ZengoProcessor().retry_due_events() == 1
+    abandoned.refresh_from_db()
+    assert abandoned.state == Event.states.processed
+    assert abandoned.attempts == 2
+    in_progress.refresh_from_db()
+    assert in_progress.state == Event.states.processing
+
+
+@pytest.mark.django_db
+def test_zengo_prune_events_command():
+    old = timezone.now() - timedelta(days=60)
+    ancient = timezone.now() - timedelta(days=120)
+    old_processed = mommy.make(
+        "zengo.Event", state=Event.states.processed, created_at=old, _quantity=3
+    )
+    recent_processed = mommy.make("zengo.Event", state=Event.states.processed)
+    old_failed = mommy.make("zengo.Event", state=Event.states.failed, created_at=old)
+    ancient_dead = mommy.make(
+        "zengo.Event", state=Event.states.dead, created_at=ancient
+    )
+    ancient_pending = mommy.make(
+        "zengo.Event", state=Event.states.pending, created_at=ancient
+    )
+    out = StringIO()
+
+    call_command("zengo_prune_events", "--batch-size", "2", stdout=out)
+
+    assert "Deleted 4 events" in out.getvalue()
+    assert not Event.objects.filter(id__in=[e.id for e in old_processed]).exists()
+    assert not Event.objects.filter(id=ancient_dead.id).exists()
+    assert set(Event.objects.values_list("id", flat=True)) == {
+        recent_processed.id,
+        old_failed.id,
+        ancient_pending.id,
+    }
+
+
+@pytest.mark.django_db
+def test_processor_get_updated_fields_ignores_sync_state():
+    ticket = mommy.make("zengo.Ticket", fingerprint="a", last_synced_comment_id=1)
+    post_ticket = copy(ticket)
+    post_ticket.fingerprint = "b"
+    post_ticket.last_synced_comment_id = 2
+    post_ticket.comments_reconciled_at = timezone.now()
+    updated_fields = service.ZengoProcessor().get_updated_fields(
+        pre_ticket=ticket, post_ticket=post_ticket, pre_comments=[], post_comments=[]
+    )
+    assert updated_fields == {}
+
+
+@pytest.mark.django_db
+def test_zendesk_user_photos_json_compatibility():
+    photo = {"content_url": "https://example.com/photo.png"}
+    zd_user = mommy.make("zengo.ZendeskUser", photos_json=json.dumps(photo))
+    zd_user.refresh_from_db()
+    assert zd_user.photos == photo
+    assert json.loads(zd_user.photos_json) == photo
+    assert zd_user.photo_url == "https://example.com/photo.png"
+
+    # as before, no photos are given as None rather than JSON `null`
+    zd_user.photos = None
+    assert zd_user.photos_json is None
+
+
+@pytest.mark.django_db
+def test_ticket_json_compatibility():
+    ticket = mommy.make(
+        "zengo.Ticket",
+        tags_json=json.dumps(["vip"]),
+        custom_fields_json=json.dumps([{"id": 1, "value": "gold"}]),
+    )
+    ticket.refresh_from_db()
+    assert ticket.tags == ["vip"]
+    assert json.loads(ticket.tags_json) == ["vip"]
+    assert json.loads(ticket.custom_fields_json) == [{"id": 1, "value": "gold"}]
+
+
+# test the asyncio service and view
+
+
+def zendesk_transport(requested_urls):
+    httpx = pytest.importorskip("httpx")
+    api_data = {
+        "/api/v2/tickets/1.json": api_responses.new_ticket,
+        "/api/v2/tickets/1/comments.json": api_responses.two_comments,
+        "/api/v2/users/show_many.json": api_responses.users_show_many,
+    }
+
+    def handler(request):
+        requested_urls.append(str(request.url))
+        return httpx.Response(200, json=api_data[request.url.path])
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.django_db
+def test_async_service_sync_ticket_id():
+    requested_urls = []
+    zengo_service = aio.AsyncZengoService(transport=zendesk_transport(requested_urls))
+
+    local_ticket, created = async_to_sync(zengo_service.sync_ticket_id_async)(1)
+
+    assert created
+    assert local_ticket.zendesk_id == 1
+    assert local_ticket.requester.zendesk_id == 1
+    assert local_ticket.comments.count() == 2
+    assert len(requested_urls) == 3
+    assert "include=users" in requested_urls[0]
+
+
+@pytest.mark.django_db
+def test_async_webhook_view(settings, mocker):
+    requested_urls = []
+    transport = zendesk_transport(requested_urls)
+    mocker.patch("zengo.aio.get_http_client", lambda: aio.create_http_client(transport))
+    settings.ZENGO_PROCESSOR_CLASS = "zengo.aio.AsyncZengoProcessor"
+    settings.ZENGO_SERVICE_CLASS = "zengo.aio.AsyncZengoService"
+    mocked_created_signal = mocker.patch("zengo.signals.ticket_created.send")
+    mocked_updated_signal = mocker.patch("zengo.signals.ticket_updated.send")
+
+    async def post():
+        return await AsyncClient().post(
+            reverse("async_webhook_view") + "?secret=zoomzoom",
+            data=json.dumps({"ids": [1, 1]}),
+            content_type="application/json",
+        )
+
+    response = async_to_sync(post)()
+
+    assert response.status_code == 200
+    # duplicate IDs are sync'd once
+    assert [e.state for e in Event.objects.all()] == [Event.states.processed]
+    assert Ticket.objects.get().comments.count() == 2
+    assert not mocked_created_signal.called
+    assert mocked_updated_signal.called
+
+
+def test_async_webhook_view_other_methods():
+    async def request(method):
+        return await getattr(AsyncClient(), method)(reverse("async_webhook_view"))
+
+    assert async_to_sync(request)("get").status_code == 405
+    assert async_to_sync(request)("options").status_code == 200
+
+
+@pytest.mark.django_db
+def test_async_processor_refuses_ticket_locks(settings):
+    settings.ZENGO_TICKET_LOCK_CLASS = "zengo.locks.CacheTicketLock"
+    settings.ZENGO_PROCESSOR_CLASS = "zengo.aio.AsyncZengoProcessor"
+
+    async def post():
+        return await AsyncClient().post(
+            reverse("async_webhook_view") + "?secret=zoomzoom",
+            data=json.dumps({"id": 1}),
+            content_type="application/json",
+        )
+
+    # refused before the event is stored, rather than leaving it pending
+    with pytest.raises(ImproperlyConfigured):
+        async_to_sync(post)()
+    assert not Event.objects.exists()
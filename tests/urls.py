@@ -1,12 +1,18 @@
-from zengo.views import WebhookView
+from zengo.views import AsyncWebhookView, WebhookView
 
 
 try:
     from django.urls import path
 
-    urlpatterns = [path("webhook/", WebhookView.as_view(), name="webhook_view")]
+    urlpatterns = [
+        path("webhook/", WebhookView.as_view(), name="webhook_view"),
+        path("webhook/async/", AsyncWebhookView.as_view(), name="async_webhook_view"),
+    ]
 
 except ImportError:
     from django.conf.urls import url
 
-    urlpatterns = [url(r"^webhook/", WebhookView.as_view(), name="webhook_view")]
+    urlpatterns = [
+        url(r"^webhook/$", WebhookView.as_view(), name="webhook_view"),
+        url(r"^webhook/async/$", AsyncWebhookView.as_view(), name="async_webhook_view"),
+    ]
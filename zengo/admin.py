@@ -111,10 +111,24 @@ class EventErrorSimpleListFilter(admin.SimpleListFilter):
 
 
 class EventAdmin(admin.ModelAdmin):
-    list_display = ["remote_ticket_id", "processing_ok", "created_at", "updated_at"]
-    list_filter = [EventErrorSimpleListFilter, "created_at", "updated_at"]
+    list_display = [
+        "remote_ticket_id",
+        "state",
+        "processing_ok",
+        "attempts",
+        "next_attempt_at",
+        "created_at",
+        "updated_at",
+    ]
+    list_filter = [
+        EventErrorSimpleListFilter,
+        "state",
+        "last_error_class",
+        "created_at",
+        "updated_at",
+    ]
     # for Django <2.1
-    raw_id_fields = ["ticket"]
+    raw_id_fields = ["ticket", "merged_into"]
     # for Django >=2.1
     autocomplete_fields = ["ticket"]
 
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import asyncio
+import logging
+import weakref
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from asgiref.sync import sync_to_async
+
+from . import ratelimit, strings
+from .service import ZengoProcessor, ZengoService, get_service
+from .settings import app_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+"""
+Zenpy, and so `ZengoService`, makes blocking requests, tying up a thread for
+the full round trip to Zendesk. Under ASGI, `AsyncZengoService` instead fetches
+a ticket's data using `httpx`, concurrently and without blocking the event
+loop, so that one loop can see many syncs in flight. Only writing the fetched
+data to the database, in a single transaction, is handed off to a thread.
+
+`httpx` is an optional dependency, installed with `django-zengo[async]`.
+"""
+
+# Zenpy requests have no timeout at all; ours are bounded, but generously so
+# as pages of comments can be large
+TIMEOUT = 60
+
+# clients are bound to the event loop they're first used with
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_httpx():
+    try:
+        import httpx
+    except ImportError:
+        raise ImproperlyConfigured(strings.httpx_missing)
+    return httpx
+
+
+def create_http_client(transport=None):
+    httpx = get_httpx()
+    return httpx.AsyncClient(
+        base_url="https://{}.zendesk.com/api/v2/".format(settings.ZENDESK_SUBDOMAIN),
+        auth=("{}/token".format(settings.ZENDESK_EMAIL), settings.ZENDESK_TOKEN),
+        limits=httpx.Limits(
+            max_connections=app_settings.CLIENT_POOL_SIZE,
+            max_keepalive_connections=(
+                app_settings.CLIENT_POOL_SIZE if app_settings.CLIENT_KEEP_ALIVE else 0
+            ),
+        ),
+        timeout=TIMEOUT,
+        transport=transport,
+    )
+
+
+def get_http_client():
+    """Return the `httpx.AsyncClient` shared by services on this event loop."""
+    loop = asyncio.get_event_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = create_http_client()
+    return client
+
+
+class AsyncZengoService(ZengoService):
+    """
+    A service which, in addition to the blocking behaviour it inherits, can
+    sync tickets from within an event loop using `sync_ticket_id_async`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # an `httpx` transport may be given, such as to mock Zendesk
+        self.transport = kwargs.pop("transport", None)
+        super(AsyncZengoService, self).__init__(*args, **kwargs)
+        self.http_client = None
+
+    def get_http_client(self):
+        if self.transport is None:
+            return get_http_client()
+        if self.http_client is None:
+            self.http_client = create_http_client(self.transport)
+        return self.http_client
+
+    async def wait_for_rate_limit(self):
+        delay = ratelimit.get_wait_delay()
+        if delay:
+            await asyncio.sleep(delay)
+        limiter = ratelimit.get_rate_limiter()
+        while limiter is not None:
+            wait = limiter.take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def request(self, url, **params):
+        """
+        GET a Zendesk API URL and return its JSON, respecting rate limits as
+        requests via the shared session do.
+        """
+        http_client = self.get_http_client()
+        attempt = 0
+        while True:
+            await self.wait_for_rate_limit()
+            response = await http_client.get(url, params=params)
+            if response.status_code != 429:
+                break
+            if attempt >= app_settings.RATE_LIMIT_RETRIES:
+                break
+            delay = ratelimit.get_retry_delay(response, attempt)
+            logger.warning(
+                "Rate limited by Zendesk",
+                extra=dict(url=url, attempt=attempt, delay=delay),
+            )
+            ratelimit.block(delay)
+            attempt += 1
+
+        delay = ratelimit.get_throttle_delay(response)
+        if delay:
+            ratelimit.block(delay)
+        response.raise_for_status()
+        return response.json()
+
+    def to_object(self, object_type, data):
+        # deserialize as Zenpy would, which also caches users such that they
+        # needn't be fetched again
+        return self.client.tickets._object_mapping.object_from_json(object_type, data)
+
+    def load_users(self, data):
+        for user in data.get("users") or []:
+            self.to_object("user", user)
+
+    async def fetch_ticket(self, ticket_id):
+        data = await self.request("tickets/{}.json".format(ticket_id), include="users")
+        self.load_users(data)
+        return self.to_object("ticket", data["ticket"])
+
+    async def fetch_comments(self, ticket_id, is_full_history, last_synced_comment_id):
+        """The async counterpart of `get_remote_comments`."""
+        url = "tickets/{}/comments.json".format(ticket_id)
+        params = dict(include_inline_images="true", include="users")
+        if not is_full_history:
+            params["sort_order"] = "desc"
+
+        remote_comments = []
+        previous_id = None
+        while url:
+            data = await self.request(url, **params)
+            # the URL of the following page carries the parameters
+            url, params = data.get("next_page"), {}
+            self.load_users(data)
+            for comment in data.get("comments") or []:
+                remote_comment = self.to_object("comment", comment)
+                # as `take_new_comments`, only stopping once sure that those
+                # remaining are older still
+                if is_full_history or remote_comment.id > last_synced_comment_id:
+                    remote_comments.append(remote_comment)
+                elif previous_id is not None and previous_id > remote_comment.id:
+                    url = None
+                    break
+                previous_id = remote_comment.id
+
+        remote_comments.sort(key=lambda c: (c.created_at, c.id))
+        return remote_comments
+
+    async def fetch_users(self, user_ids):
+        """
+        The async counterpart of `get_remote_users`, fetching any users not
+        already sideloaded a hundred at a time, concurrently.
+        """
+        remote_users = {}
+        missing_ids = []
+        for user_id in sorted(set(user_ids)):
+            remote_zd_user = self.client.cache.get("user", user_id)
+            if remote_zd_user is None:
+                missing_ids.append(user_id)
+            else:
+                remote_users[user_id] = remote_zd_user
+
+        fetches = []
+        while missing_ids:
+            batch, missing_ids = missing_ids[:100], missing_ids[100:]
+            fetches.append(
+                self.request("users/show_many.json", ids=",".join(map(str, batch)))
+            )
+        for data in await asyncio.gather(*fetches):
+            for user in data["users"]:
+                remote_users[user["id"]] = self.to_object("user", user)
+        return remote_users
+
+    async def sync_ticket_id_async(self, ticket_id):
+        """
+        Sync a ticket as `sync_ticket_id` does, fetching the ticket and its
+        comments concurrently, then any users not sideloaded with them.
+        """
+        is_full_history, last_synced_comment_id = await sync_to_async(
+            self.get_comment_sync_state
+        )(ticket_id)
+        remote_zd_ticket, remote_comments = await asyncio.gather(
+            self.fetch_ticket(ticket_id),
+            self.fetch_comments(ticket_id, is_full_history, last_synced_comment_id),
+        )
+        remote_users = await self.fetch_users(
+            [remote_zd_ticket.requester_id]
+            + [c.author_id for c in remote_comments if c.author_id != -1]  # noqa
+        )
+        return await sync_to_async(self.persist_ticket)(
+            remote_zd_ticket, remote_comments, is_full_history, remote_users
+        )
+
+
+class AsyncZengoProcessor(ZengoProcessor):
+    """
+    A processor which, in addition to the blocking behaviour it inherits, can
+    process events from within an event loop, as `AsyncWebhookView` does.
+
+    Tickets are sync'd without blocking if the configured service is an
+    `AsyncZengoService`, and in a thread otherwise. Per-ticket locks, which
+    block or are bound to a transaction, aren't supported, and are refused
+    on creation, before any events are stored.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncZengoProcessor, self).__init__(*args, **kwargs)
+        if app_settings.TICKET_LOCK_CLASS is not None:
+            raise ImproperlyConfigured(strings.async_ticket_lock)
+
+    async def begin_processing_event_async(self, event):
+        return await self.process_event_and_record_errors_async(event)
+
+    async def begin_processing_events_async(self, events):
+        """
+        Process events received together concurrently, sharing a service
+        between them, as `begin_processing_events` does.
+        """
+        self.service = get_service()
+        try:
+            results = await asyncio.gather(
+                *[self.begin_processing_event_async(event) for event in events],
+                return_exceptions=True
+            )
+        finally:
+            self.service = None
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    async def process_event_and_record_errors_async(self, event):
+        event.attempts += 1
+        try:
+            await self.process_event_async(event)
+            await sync_to_async(self.record_event_processed)(event)
+
+        except Exception as e:
+            await sync_to_async(self.record_event_failed)(event, e)
+            raise
+
+    async def process_event_async(self, event):
+        ticket_id = event.remote_ticket_id
+        pre_sync_ticket = await sync_to_async(self.get_pre_sync_ticket)(ticket_id)
+
+        service = self.service or get_service()
+        if isinstance(service, AsyncZengoService):
+            result = await service.sync_ticket_id_async(ticket_id)
+        else:
+            result = await sync_to_async(service.sync_ticket_id)(ticket_id)
+
+        await sync_to_async(self.send_ticket_signals)(pre_sync_ticket, result)
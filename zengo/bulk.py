@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import hashlib
+import json
+
+from django.db import connections, models, router
+
+from .settings import app_settings
+
+
+def get_update_fields(model, unique_field):
+    """Return the names of all fields an upsert of `model` should write."""
+    return [
+        f.name
+        for f in model._meta.concrete_fields
+        if not f.primary_key and f.name != unique_field
+    ]
+
+
+def fingerprint(values):
+    """Return a compact digest of a mapping of field names to values."""
+    data = json.dumps(values, sort_keys=True, separators=(",", ":"), default=_encode)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _encode(value):
+    # related instances are identified by their primary key, everything else
+    # (dates, decimals, etc) by its string representation
+    if isinstance(value, models.Model):
+        return value.pk
+    return str(value)
+
+
+def update_or_create(model, defaults, counter=None, changes=None, state=None, **lookup):
+    """
+    Like `QuerySet.update_or_create`, but skipping the UPDATE entirely when the
+    fingerprint of `defaults` matches that of the last write.
+
+    `state` holds fields recording the progress of syncing rather than remote
+    data. They are left out of the fingerprint, and when it matches they are
+    only written if their values have changed.
+
+    If given, `counter` is incremented by the number of rows written, and the
+    `changes` dict is given the old and new values of each field an UPDATE
+    changed, keyed on field name.
+    """
+    defaults = dict(defaults, fingerprint=fingerprint(defaults))
+    state = state or {}
+    manager = model._default_manager.db_manager(router.db_for_write(model))
+
+    instance = manager.filter(**lookup).first()
+    if instance is not None and instance.fingerprint == defaults["fingerprint"]:
+        # the remote data is unchanged, so at most the sync state needs writing
+        changed = _assign(instance, state, changes)
+        if not changed:
+            return instance, False
+        instance.save(update_fields=changed)
+        created = False
+    elif instance is None:
+        instance, created = manager.update_or_create(
+            defaults=dict(defaults, **state), **lookup
+        )
+    else:
+        defaults.update(state)
+        _assign(instance, defaults, changes)
+        instance.save(update_fields=list(defaults))
+        created = False
+
+    if counter is not None:
+        counter[model._meta.model_name] += 1
+    return instance, created
+
+
+def _assign(instance, values, changes):
+    # set `values` on `instance`, returning the names of the fields changed
+    changed = []
+    for name, value in values.items():
+        field = instance._meta.get_field(name)
+        old_value = field.value_from_object(instance)
+        setattr(instance, name, value)
+        new_value = field.value_from_object(instance)
+        if old_value != new_value:
+            changed.append(name)
+            if changes is not None and name != "fingerprint":
+                changes[name] = {"old": old_value, "new": new_value}
+    return changed
+
+
+def supports_native_upsert(connection):
+    # `bulk_create(update_conflicts=...)` arrived in Django 4.1; older
+    # versions lack the feature flag entirely
+    return getattr(connection.features, "supports_update_conflicts_with_target", False)
+
+
+def upsert(
+    model,
+    objs,
+    update_fields=None,
+    unique_field="zendesk_id",
+    counter=None,
+    created=None,
+    updated=None,
+):
+    """
+    Insert or update unsaved `objs` keyed on `unique_field` using a handful of
+    statements, rather than a SELECT and INSERT/UPDATE per instance.
+
+    Where the database supports it, a single `INSERT ... ON CONFLICT DO UPDATE`
+    is issued. Otherwise existing rows are located with one query and then
+    written using `bulk_update` and `bulk_create`.
+
+    When a `fingerprint` field is among those written, rows whose fingerprint
+    is unchanged since the last write are skipped. If given, `counter` is
+    incremented by the number of rows written, and the `created` and `updated`
+    lists are extended with the instances inserted and updated respectively.
+
+    Returns a mapping of `unique_field` values to primary keys such that
+    related rows can be linked up by the caller.
+    """
+    if not objs:
+        return {}
+
+    if update_fields is None:
+        update_fields = get_update_fields(model, unique_field)
+
+    # de-duplicate, letting the last instance win, and write in a consistent
+    # order to avoid deadlocking with concurrent syncs of the same rows
+    objs = list({getattr(o, unique_field): o for o in objs}.values())
+    objs.sort(key=lambda o: getattr(o, unique_field))
+    keys = [getattr(o, unique_field) for o in objs]
+
+    db = router.db_for_write(model)
+    manager = model._default_manager.db_manager(db)
+    native = supports_native_upsert(connections[db])
+
+    fingerprinted = "fingerprint" in update_fields
+    if fingerprinted:
+        _set_fingerprints(model, objs, update_fields)
+
+    # existing rows need locating to compare fingerprints, to update them
+    # without native upserts, or to tell them apart from those inserted
+    existing = {}
+    if fingerprinted or not native or (created, updated) != (None, None):
+        columns = ["pk", "fingerprint"] if fingerprinted else ["pk"]
+        existing = _select(manager, unique_field, keys, *columns)
+
+    pks = {}
+    to_write = []
+    for obj in objs:
+        key = getattr(obj, unique_field)
+        row = existing.get(key)
+        if row is not None and fingerprinted and row[1] == obj.fingerprint:
+            pks[key] = row[0]
+            continue
+        if row is not None and not native:
+            obj.pk = row[0]
+        to_write.append(obj)
+
+    if to_write:
+        _write(manager, to_write, update_fields, unique_field, native)
+        if counter is not None:
+            counter[model._meta.model_name] += len(to_write)
+
+    pks.update(_get_pks(manager, unique_field, to_write))
+    _record_written(to_write, unique_field, pks, existing, created, updated)
+    return pks
+
+
+def _record_written(objs, unique_field, pks, existing, created, updated):
+    for obj in objs:
+        key = getattr(obj, unique_field)
+        obj.pk = pks[key]
+        written = updated if key in existing else created
+        if written is not None:
+            written.append(obj)
+
+
+def _get_pks(manager, unique_field, objs):
+    pks = {getattr(o, unique_field): o.pk for o in objs if o.pk is not None}
+    missing = [getattr(o, unique_field) for o in objs if o.pk is None]
+    if missing:
+        # not all backends return primary keys from bulk inserts
+        pks.update(
+            (key, row[0])
+            for key, row in _select(manager, unique_field, missing, "pk").items()
+        )
+    return pks
+
+
+def _set_fingerprints(model, objs, update_fields):
+    fields = [
+        model._meta.get_field(name) for name in update_fields if name != "fingerprint"
+    ]
+    for obj in objs:
+        obj.fingerprint = fingerprint(
+            {f.attname: getattr(obj, f.attname) for f in fields}
+        )
+
+
+def _select(manager, unique_field, keys, *fields):
+    rows = manager.filter(**{"{}__in".format(unique_field): keys}).values_list(
+        unique_field, *fields
+    )
+    return {row[0]: row[1:] for row in rows}
+
+
+def _write(manager, objs, update_fields, unique_field, native):
+    batch_size = app_settings.UPSERT_BATCH_SIZE
+    if native:
+        manager.bulk_create(
+            objs,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=[unique_field],
+            update_fields=update_fields,
+        )
+        return
+
+    to_update = [o for o in objs if o.pk is not None]
+    to_create = [o for o in objs if o.pk is None]
+    if to_update:
+        manager.bulk_update(to_update, update_fields, batch_size=batch_size)
+    if to_create:
+        manager.bulk_create(to_create, batch_size=batch_size)
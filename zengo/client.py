@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+import os
+import socket
+import threading
+
+from django.conf import settings
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from zenpy import Zenpy
+
+from . import ratelimit
+from .settings import app_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+"""
+Zenpy clients are cheap to build but each one, by default, creates its own
+`requests` session and so its own connection pool. Here we keep a registry of
+sessions shared by all clients in the process, so that webhook handling reuses
+warm, already negotiated connections to Zendesk.
+
+Zenpy clients themselves are not shared, as each carries an object cache that
+would otherwise serve stale tickets and users between syncs.
+"""
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class ZendeskHTTPAdapter(HTTPAdapter):
+    """
+    Connection pooling adapter optionally enabling TCP keep-alive probes, and
+    throttling requests to respect Zendesk's rate limits.
+    """
+
+    def __init__(self, keep_alive=True, **kwargs):
+        self.keep_alive = keep_alive
+        super(ZendeskHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keep_alive:
+            # stop idle pooled connections being silently dropped by NATs and
+            # load balancers between requests
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        return super(ZendeskHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            ratelimit.wait()
+            limiter = ratelimit.get_rate_limiter()
+            if limiter is not None:
+                limiter.acquire()
+
+            response = super(ZendeskHTTPAdapter, self).send(request, **kwargs)
+            if response.status_code != 429:
+                break
+            if attempt >= app_settings.RATE_LIMIT_RETRIES:
+                return response
+
+            delay = ratelimit.get_retry_delay(response, attempt)
+            logger.warning(
+                "Rate limited by Zendesk",
+                extra=dict(url=request.url, attempt=attempt, delay=delay),
+            )
+            ratelimit.block(delay)
+            response.close()
+            attempt += 1
+
+        delay = ratelimit.get_throttle_delay(response)
+        if delay:
+            ratelimit.block(delay)
+        return response
+
+
+def create_session():
+    session = requests.Session()
+    adapter = ZendeskHTTPAdapter(
+        keep_alive=app_settings.CLIENT_KEEP_ALIVE,
+        # all requests go to the one Zendesk host
+        pool_connections=1,
+        pool_maxsize=app_settings.CLIENT_POOL_SIZE,
+        **Zenpy.http_adapter_kwargs()
+    )
+    session.mount("https://", adapter)
+    if not app_settings.CLIENT_KEEP_ALIVE:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def get_session():
+    """
+    Return the process-wide session for the configured Zendesk account,
+    lazily creating it in a thread-safe manner.
+    """
+    key = (settings.ZENDESK_SUBDOMAIN, settings.ZENDESK_EMAIL, settings.ZENDESK_TOKEN)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = create_session()
+    return session
+
+
+def get_client():
+    """Return a Zenpy client using the shared session."""
+    return Zenpy(
+        email=settings.ZENDESK_EMAIL,
+        token=settings.ZENDESK_TOKEN,
+        subdomain=settings.ZENDESK_SUBDOMAIN,
+        session=get_session(),
+        # rate limited requests are retried by our adapter; rather than Zenpy
+        # retrying them forever once we've given up, have it raise
+        ratelimit_budget=0,
+    )
+
+
+def reset_sessions():
+    """Discard all shared sessions, closing their pooled connections."""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+def _forget_sessions():
+    # a forked child must never write to sockets owned by its parent
+    global _sessions_lock
+    _sessions.clear()
+    _sessions_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_sessions)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import contextlib
+import logging
+import threading
+import time
+import uuid
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections, router, transaction
+
+from . import models, signals
+from .settings import app_settings
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+"""
+Ready-made locks for serializing the processing of events per ticket, for use
+when running several processes or queue workers. Select one by setting
+`ZENGO_TICKET_LOCK_CLASS` to its dotted path.
+"""
+
+
+class LockTimeout(Exception):
+    """The lock for a ticket could not be acquired in time."""
+
+
+class BaseTicketLock(object):
+    """
+    Poll for a lock on a ticket until acquired or `ZENGO_TICKET_LOCK_TIMEOUT`
+    seconds pass, reporting the time spent waiting via the
+    `ticket_lock_waited` signal.
+
+    Subclasses implement `try_acquire` and `release`.
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, timeout=None):
+        if timeout is None:
+            timeout = app_settings.TICKET_LOCK_TIMEOUT
+        self.timeout = timeout
+
+    def try_acquire(self, ticket_id):
+        raise NotImplementedError()
+
+    def release(self, ticket_id):
+        raise NotImplementedError()
+
+    @contextlib.contextmanager
+    def __call__(self, ticket_id):
+        self.wait(ticket_id)
+        try:
+            yield
+        finally:
+            self.release(ticket_id)
+
+    def wait(self, ticket_id):
+        started = time.monotonic()
+        acquired = self.try_acquire(ticket_id)
+        while not acquired and time.monotonic() - started < self.timeout:
+            time.sleep(self.poll_interval)
+            acquired = self.try_acquire(ticket_id)
+        wait_time = time.monotonic() - started
+
+        logger.debug(
+            "Waited for Zendesk ticket lock",
+            extra=dict(ticket_id=ticket_id, wait_time=wait_time, acquired=acquired),
+        )
+        signals.ticket_lock_waited.send(
+            sender=self.__class__,
+            ticket_id=ticket_id,
+            wait_time=wait_time,
+            acquired=acquired,
+        )
+        if not acquired:
+            raise LockTimeout(
+                "Timed out waiting {:.1f}s for lock on ticket {}".format(
+                    wait_time, ticket_id
+                )
+            )
+
+
+class AdvisoryTicketLock(BaseTicketLock):
+    """
+    Lock tickets using PostgreSQL session-level advisory locks, keyed on
+    `namespace` and the ticket ID.
+    """
+
+    namespace = 0x5A474F
+
+    def __init__(self, *args, **kwargs):
+        super(AdvisoryTicketLock, self).__init__(*args, **kwargs)
+        self.connection = connections[router.db_for_write(models.Ticket)]
+        if self.connection.vendor != "postgresql":
+            raise ImproperlyConfigured("Advisory locks require PostgreSQL.")
+
+    def get_key(self, ticket_id):
+        # fold the ticket ID into the signed 32 bit range of a two-key lock
+        return (int(ticket_id) % 2**32) - 2**31
+
+    def try_acquire(self, ticket_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_try_advisory_lock(%s, %s)",
+                [self.namespace, self.get_key(ticket_id)],
+            )
+            return cursor.fetchone()[0]
+
+    def release(self, ticket_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_unlock(%s, %s)",
+                [self.namespace, self.get_key(ticket_id)],
+            )
+
+
+class RowTicketLock(BaseTicketLock):
+    """
+    Lock tickets using `SELECT ... FOR UPDATE NOWAIT` on a `TicketLock` row.
+
+    A row lock is held by a transaction, and rather than hold one open for
+    the whole of processing, requests of Zendesk included, the row is only
+    locked once a sync begins the transaction writing the ticket, and so
+    for as long as the writes take. Syncs of a ticket write one at a time,
+    each reporting only the changes it wrote, such that signals don't double
+    up, while fetching from Zendesk concurrently; a sync holding older data
+    than another which wrote first writes nothing, rather than overwriting
+    newer data.
+    """
+
+    @contextlib.contextmanager
+    def __call__(self, ticket_id):
+        models.TicketLock.objects.get_or_create(remote_ticket_id=ticket_id)
+        deferred = get_deferred_locks()
+        deferred[ticket_id] = self
+        try:
+            yield
+        finally:
+            deferred.pop(ticket_id, None)
+
+    def try_acquire(self, ticket_id):
+        try:
+            # a savepoint, so that a failure to lock leaves our transaction usable
+            with transaction.atomic():
+                list(
+                    models.TicketLock.objects.select_for_update(nowait=True).filter(
+                        remote_ticket_id=ticket_id
+                    )
+                )
+        except DatabaseError:
+            return False
+        return True
+
+    def release(self, ticket_id):
+        # released when the transaction ends
+        pass
+
+
+def get_deferred_locks():
+    """Return the locks of this thread to be taken by a ticket's writes."""
+    if not hasattr(_local, "deferred_locks"):
+        _local.deferred_locks = {}
+    return _local.deferred_locks
+
+
+def acquire_deferred_lock(ticket_id):
+    """
+    Take any lock on a ticket deferred to its writes, which must be made in
+    the current transaction.
+    """
+    lock = get_deferred_locks().get(ticket_id)
+    if lock is not None:
+        lock.wait(ticket_id)
+
+
+class CacheTicketLock(BaseTicketLock):
+    """
+    Lock tickets using atomic adds to the `ZENGO_TICKET_LOCK_CACHE` cache,
+    which must be shared by all processes, such as Redis or Memcached.
+
+    Locks expire after `ZENGO_TICKET_LOCK_EXPIRY` seconds, should their holder
+    die without releasing them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CacheTicketLock, self).__init__(*args, **kwargs)
+        self.cache = caches[app_settings.TICKET_LOCK_CACHE]
+        self.tokens = {}
+
+    def get_key(self, ticket_id):
+        return "zengo:ticket-lock:{}".format(ticket_id)
+
+    def try_acquire(self, ticket_id):
+        token = uuid.uuid4().hex
+        if self.cache.add(
+            self.get_key(ticket_id), token, app_settings.TICKET_LOCK_EXPIRY
+        ):
+            self.tokens[ticket_id] = token
+            return True
+        return False
+
+    def release(self, ticket_id):
+        token = self.tokens.pop(ticket_id, None)
+        # don't release a lock that expired and was taken by someone else
+        if token is not None and self.cache.get(self.get_key(ticket_id)) == token:
+            self.cache.delete(self.get_key(ticket_id))
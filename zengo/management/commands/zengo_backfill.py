@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import SyncCursor
+from ...pool import sync_tickets
+from ...service import get_service
+from ...settings import app_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Sync all tickets from Zendesk's incremental ticket export, resuming "
+        "from the last checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--start-time",
+            type=int,
+            default=0,
+            help="Unix time to begin the export at, when there is no checkpoint.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore any checkpoint and begin again from --start-time.",
+        )
+        parser.add_argument(
+            "--name",
+            default="tickets",
+            help="Name of the checkpoint, allowing several independent backfills.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=app_settings.SYNC_CONCURRENCY,
+            help="Number of tickets to sync concurrently.",
+        )
+        parser.add_argument(
+            "--processes",
+            action="store_true",
+            help="Sync using a pool of processes, which fetch each ticket again.",
+        )
+
+    def handle(self, *args, **options):
+        service = get_service()
+        checkpoint, created = SyncCursor.objects.get_or_create(name=options["name"])
+        cursor = None if options["restart"] else checkpoint.cursor
+
+        synced = failed = 0
+        # once a page has failures, the checkpoint is held before it so that
+        # they're sync'd again when the backfill is resumed
+        held = False
+        end_of_stream = False
+        while not end_of_stream:
+            tickets, cursor, end_of_stream = service.get_incremental_tickets(
+                start_time=options["start_time"], cursor=cursor
+            )
+            # the export includes tickets deleted since, which we can't sync
+            tickets = [t for t in tickets if t.status != "deleted"]
+            if options["processes"]:
+                # tickets can't be handed to another process, only their IDs
+                tickets = [t.id for t in tickets]
+            page_synced, page_failed = sync_tickets(
+                tickets,
+                workers=options["workers"],
+                processes=options["processes"],
+                service=service,
+            )
+            synced += page_synced
+            failed += page_failed
+            held = held or bool(page_failed)
+
+            if cursor is None:
+                break
+            if not held:
+                # a crash from here on only means re-syncing the page that follows
+                checkpoint.cursor = cursor
+                checkpoint.save(update_fields=("cursor", "updated_at"))
+            self.stdout.write("Sync'd {} tickets, {} failed".format(synced, failed))
+
+        if failed:
+            raise CommandError(
+                "{} tickets failed to sync; the checkpoint is held at the first "
+                "page with failures, so that running again retries them".format(failed)
+            )
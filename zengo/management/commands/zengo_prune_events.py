@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from datetime import timedelta
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import Event
+from ...settings import app_settings
+
+
+class Command(BaseCommand):
+    help = "Delete Zendesk events older than their retention period."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processed-days",
+            type=int,
+            default=app_settings.EVENT_RETENTION_DAYS,
+            help="Days to keep processed and merged events for.",
+        )
+        parser.add_argument(
+            "--failed-days",
+            type=int,
+            default=app_settings.FAILED_EVENT_RETENTION_DAYS,
+            help="Days to keep failed and dead-lettered events for.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=app_settings.PRUNE_BATCH_SIZE,
+            help="Number of events deleted per statement.",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="Seconds to pause between batches, easing load on replicas.",
+        )
+
+    def handle(self, *args, **options):
+        policies = [
+            (
+                (Event.states.processed, Event.states.merged),
+                options["processed_days"],
+            ),
+            ((Event.states.failed, Event.states.dead), options["failed_days"]),
+        ]
+        deleted = 0
+        for states, days in policies:
+            if days is None:
+                continue
+            cutoff = timezone.now() - timedelta(days=days)
+            deleted += self.prune(
+                Event.objects.filter(state__in=states, created_at__lt=cutoff),
+                options["batch_size"],
+                options["pause"],
+            )
+        self.stdout.write("Deleted {} events".format(deleted))
+
+    def prune(self, events, batch_size, pause):
+        # delete by primary key in short batches, so that each statement is
+        # cheap and no locks are held for long
+        deleted = 0
+        while True:
+            ids = list(events.order_by("id").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            total, per_model = Event.objects.filter(id__in=ids).delete()
+            deleted += per_model.get(Event._meta.label, 0)
+            if pause:
+                time.sleep(pause)
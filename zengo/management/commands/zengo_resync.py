@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from ...models import Ticket
+from ...pool import sync_tickets
+from ...settings import app_settings
+
+
+class Command(BaseCommand):
+    help = "Sync tickets already known locally again from Zendesk."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "ticket_ids",
+            nargs="*",
+            type=int,
+            help="Zendesk IDs of the tickets to sync; by default all of them.",
+        )
+        parser.add_argument("--min-id", type=int, help="Lowest Zendesk ticket ID.")
+        parser.add_argument("--max-id", type=int, help="Highest Zendesk ticket ID.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=app_settings.SYNC_CONCURRENCY,
+            help="Number of tickets to sync concurrently.",
+        )
+        parser.add_argument(
+            "--processes",
+            action="store_true",
+            help="Sync using a pool of processes rather than threads.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=app_settings.SYNC_CHUNK_SIZE,
+            help="Number of contiguous ticket IDs handed to a worker at a time.",
+        )
+
+    def handle(self, *args, **options):
+        ticket_ids = options["ticket_ids"]
+        if not ticket_ids:
+            tickets = Ticket.objects.all()
+            if options["min_id"] is not None:
+                tickets = tickets.filter(zendesk_id__gte=options["min_id"])
+            if options["max_id"] is not None:
+                tickets = tickets.filter(zendesk_id__lte=options["max_id"])
+            ticket_ids = list(tickets.values_list("zendesk_id", flat=True))
+
+        synced, failed = sync_tickets(
+            ticket_ids,
+            workers=options["workers"],
+            processes=options["processes"],
+            chunk_size=options["chunk_size"],
+        )
+        self.stdout.write("Sync'd {} tickets, {} failed".format(synced, failed))
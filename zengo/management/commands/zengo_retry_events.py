@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...service import get_processor
+from ...settings import app_settings
+
+
+class Command(BaseCommand):
+    help = "Retry failed Zendesk events that are due another attempt."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            help="Maximum number of events to retry per pass.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep retrying events as they become due, rather than exiting.",
+        )
+
+    def handle(self, *args, **options):
+        processor = get_processor()
+        while True:
+            retried = processor.retry_due_events(limit=options["limit"])
+            if options["verbosity"] > 1 or not options["loop"]:
+                self.stdout.write("Retried {} events".format(retried))
+            if not options["loop"]:
+                return
+            if not retried:
+                time.sleep(app_settings.WORKER_POLL_INTERVAL)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ...service import QueuedZengoProcessor, get_processor
+from ...settings import app_settings
+
+
+class Command(BaseCommand):
+    help = "Process Zendesk events queued by the QueuedZengoProcessor."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=app_settings.WORKER_CONCURRENCY,
+            help="Number of events to process concurrently.",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once the queue has been emptied.",
+        )
+
+    def handle(self, *args, **options):
+        processor = get_processor()
+        if not isinstance(processor, QueuedZengoProcessor):
+            raise CommandError(
+                "ZENGO_PROCESSOR_CLASS must be a QueuedZengoProcessor to use a worker."
+            )
+
+        stopping = threading.Event()
+        threads = [
+            threading.Thread(
+                target=self.work, args=(processor, stopping, options["burst"])
+            )
+            for i in range(options["workers"])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                # join with a timeout so that we remain interruptible
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            # let in-flight events finish
+            stopping.set()
+            for thread in threads:
+                thread.join()
+
+    def work(self, processor, stopping, burst):
+        try:
+            while not stopping.is_set():
+                try:
+                    event = processor.process_next_event()
+                except Exception:
+                    # processing errors are logged and recorded against the
+                    # event; pause in case the database itself is at fault
+                    stopping.wait(app_settings.WORKER_POLL_INTERVAL)
+                    continue
+                if event is None:
+                    if burst:
+                        return
+                    stopping.wait(app_settings.WORKER_POLL_INTERVAL)
+        finally:
+            # each thread has its own database connection
+            connections.close_all()
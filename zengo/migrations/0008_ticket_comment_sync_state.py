@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0007_alter_event_remote_ticket_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ticket",
+            name="comments_reconciled_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="ticket",
+            name="last_synced_comment_id",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
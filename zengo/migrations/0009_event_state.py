@@ -0,0 +1,58 @@
+from django.db import migrations, models
+
+import konst.models.fields
+
+
+BATCH_SIZE = 1000
+
+
+def mark_existing_events_handled(apps, schema_editor):
+    """Mark events stored before the queue existed, a batch of rows at a time."""
+    # they were all processed inline, failing if an error was recorded
+    Event = apps.get_model("zengo", "Event")
+    manager = Event._base_manager.using(schema_editor.connection.alias)
+    last_pk = 0
+    while True:
+        pks = list(
+            manager.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:BATCH_SIZE]
+        )
+        if not pks:
+            return
+        batch = manager.filter(pk__gt=last_pk, pk__lte=pks[-1])
+        batch.filter(error__isnull=True).update(state="processed")
+        batch.filter(error__isnull=False).update(state="failed")
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0008_ticket_comment_sync_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="state",
+            field=konst.models.fields.ConstantChoiceCharField(
+                choices=[
+                    ("pending", "pending"),
+                    ("processing", "processing"),
+                    ("processed", "processed"),
+                    ("failed", "failed"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(
+            mark_existing_events_handled, reverse_code=migrations.RunPython.noop
+        ),
+    ]
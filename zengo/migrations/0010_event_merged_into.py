@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import konst.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0009_event_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="merged_into",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="merged_events",
+                to="zengo.event",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="event",
+            name="state",
+            field=konst.models.fields.ConstantChoiceCharField(
+                choices=[
+                    ("pending", "pending"),
+                    ("processing", "processing"),
+                    ("processed", "processed"),
+                    ("failed", "failed"),
+                    ("merged", "merged"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0010_event_merged_into"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TicketLock",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("remote_ticket_id", models.BigIntegerField(unique=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0011_ticketlock"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attachment",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name="ticket",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name="zendeskuser",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+import konst.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0013_synccursor"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="last_error_class",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="next_attempt_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="event",
+            name="state",
+            field=konst.models.fields.ConstantChoiceCharField(
+                choices=[
+                    ("pending", "pending"),
+                    ("processing", "processing"),
+                    ("processed", "processed"),
+                    ("failed", "failed"),
+                    ("merged", "merged"),
+                    ("dead", "dead"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+    ]
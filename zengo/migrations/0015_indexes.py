@@ -0,0 +1,56 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0014_event_retries"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["ticket", "created_at"], name="zengo_comment_ticket_created"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                fields=["remote_ticket_id", "created_at"],
+                name="zengo_event_ticket_created",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                fields=["state", "created_at"], name="zengo_event_state_created"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(fields=["created_at"], name="zengo_event_created"),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                condition=models.Q(("error__isnull", False)),
+                fields=["created_at"],
+                name="zengo_event_errored",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                condition=models.Q(("state", "failed")),
+                fields=["next_attempt_at"],
+                name="zengo_event_retry_due",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="zendeskuser",
+            index=models.Index(fields=["email"], name="zengo_zduser_email"),
+        ),
+    ]
@@ -0,0 +1,71 @@
+import json
+
+from django.db import migrations, transaction
+
+
+BATCH_SIZE = 1000
+
+
+def parse(value):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def copy_fields(manager, fields, transform):
+    """Copy and transform field values, a batch of rows at a time."""
+    last_pk = 0
+    while True:
+        batch = list(
+            manager.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only(*[source for source, target in fields])[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        for instance in batch:
+            for source, target in fields:
+                setattr(instance, target, transform(getattr(instance, source)))
+        # each batch is committed on its own, so tickets are never locked for
+        # long and an interrupted copy can simply be run again
+        with transaction.atomic(using=manager.db):
+            manager.bulk_update(batch, [target for source, target in fields])
+        last_pk = batch[-1].pk
+
+
+def convert(model, fields):
+    """Convert JSON encoded text in `fields`, pairs of old and new names."""
+
+    def get_manager(apps, schema_editor):
+        return apps.get_model("zengo", model)._base_manager.using(
+            schema_editor.connection.alias
+        )
+
+    def forwards(apps, schema_editor):
+        copy_fields(get_manager(apps, schema_editor), fields, parse)
+
+    def backwards(apps, schema_editor):
+        reversed_fields = [(new, old) for old, new in fields]
+        copy_fields(get_manager(apps, schema_editor), reversed_fields, json.dumps)
+
+    return migrations.RunPython(forwards, backwards, elidable=True)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("zengo", "0016_json_fields"),
+    ]
+
+    operations = [
+        convert(
+            "Ticket",
+            [("custom_fields", "custom_fields_data"), ("tags", "tags_data")],
+        ),
+        convert("ZendeskUser", [("photos_json", "photos")]),
+    ]
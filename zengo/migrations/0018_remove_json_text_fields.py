@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+GIN_INDEXES = [
+    ("zengo_ticket_tags_gin", "tags"),
+    ("zengo_ticket_custom_fields_gin", "custom_fields"),
+]
+
+
+def create_gin_indexes(apps, schema_editor):
+    # allow filtering tickets by tag or custom field value, such as with
+    # `tags__contains`, without scanning every ticket
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, column in GIN_INDEXES:
+        schema_editor.execute(
+            "CREATE INDEX {} ON zengo_ticket USING gin ({})".format(name, column)
+        )
+
+
+def drop_gin_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, column in GIN_INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS {}".format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0017_copy_json_fields"),
+    ]
+
+    operations = [
+        migrations.RemoveField(model_name="ticket", name="custom_fields"),
+        migrations.RemoveField(model_name="ticket", name="tags"),
+        migrations.RemoveField(model_name="zendeskuser", name="photos_json"),
+        migrations.RenameField(
+            model_name="ticket", old_name="custom_fields_data", new_name="custom_fields"
+        ),
+        migrations.RenameField(
+            model_name="ticket", old_name="tags_data", new_name="tags"
+        ),
+        migrations.RunPython(create_gin_indexes, drop_gin_indexes),
+    ]
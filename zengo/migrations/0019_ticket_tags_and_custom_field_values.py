@@ -0,0 +1,121 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+
+
+def get_custom_field_values(value):
+    # as `TicketCustomFieldValue.get_values` at the time of writing
+    values = value if isinstance(value, list) else [value]
+    indexable = set()
+    for value in values:
+        if value is None or value == "":
+            continue
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        value = str(value)
+        if len(value) <= 255:
+            indexable.add(value)
+    return indexable
+
+
+def populate(apps, schema_editor):
+    """Index the tags and custom field values of existing tickets in batches."""
+    db = schema_editor.connection.alias
+    Ticket = apps.get_model("zengo", "Ticket")
+    TicketTag = apps.get_model("zengo", "TicketTag")
+    TicketCustomFieldValue = apps.get_model("zengo", "TicketCustomFieldValue")
+
+    last_pk = 0
+    while True:
+        batch = list(
+            Ticket._base_manager.using(db)
+            .filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("tags", "custom_fields")[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        tags, values = [], []
+        for ticket in batch:
+            for name in set(ticket.tags or []):
+                if len(name) <= 255:
+                    tags.append(TicketTag(ticket_id=ticket.pk, name=name))
+            for field in ticket.custom_fields or []:
+                for value in get_custom_field_values(field.get("value")):
+                    values.append(
+                        TicketCustomFieldValue(
+                            ticket_id=ticket.pk, field_id=field["id"], value=value
+                        )
+                    )
+        TicketTag._base_manager.using(db).bulk_create(tags)
+        TicketCustomFieldValue._base_manager.using(db).bulk_create(values)
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zengo", "0018_remove_json_text_fields"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TicketTag",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=255)),
+                (
+                    "ticket",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ticket_tags",
+                        to="zengo.ticket",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TicketCustomFieldValue",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("field_id", models.BigIntegerField()),
+                ("value", models.CharField(max_length=255)),
+                (
+                    "ticket",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="custom_field_values",
+                        to="zengo.ticket",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="tickettag",
+            index=models.Index(fields=["name"], name="zengo_tickettag_name"),
+        ),
+        migrations.AddConstraint(
+            model_name="tickettag",
+            constraint=models.UniqueConstraint(
+                fields=("ticket", "name"), name="zengo_tickettag_unique"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ticketcustomfieldvalue",
+            index=models.Index(
+                fields=["field_id", "value"], name="zengo_customfieldvalue_value"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ticketcustomfieldvalue",
+            constraint=models.UniqueConstraint(
+                fields=("ticket", "field_id", "value"),
+                name="zengo_customfieldvalue_unique",
+            ),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop, elidable=True),
+    ]
@@ -17,6 +17,22 @@ from konst.models.fields import ConstantChoiceCharField
 TextURLField = partial(models.TextField, validators=[URLValidator()])  # noqa
 
 
+def json_text_property(name):
+    """
+    Return a property reading and writing the JSONField `name` as JSON
+    encoded text, as such data was stored before JSONFields were used.
+    """
+
+    def getter(self):
+        value = getattr(self, name)
+        return None if value is None else json.dumps(value)
+
+    def setter(self, value):
+        setattr(self, name, json.loads(value) if value else None)
+
+    return property(getter, setter)
+
+
 class ZendeskUser(models.Model):
     """
     Link between a user in Zendesk and the local system.
@@ -37,8 +53,8 @@ class ZendeskUser(models.Model):
     alias = models.TextField(null=True, blank=True)
     email = models.EmailField(null=True, blank=True)
     active = models.BooleanField(default=True)
-    # we store all of the photo details from the API as JSON encoded text
-    photos_json = models.TextField(null=True, blank=True)
+    # we store all of the photo details from the API as JSON
+    photos = models.JSONField(null=True, blank=True)
 
     role = ConstantChoiceCharField(constants=roles, max_length=8)
 
@@ -49,6 +65,15 @@ class ZendeskUser(models.Model):
         get_user_model(), null=True, blank=True, on_delete=models.PROTECT
     )
 
+    # digest of the remote data last sync'd, used to skip unchanged writes
+    fingerprint = models.CharField(max_length=32, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # finding the Zendesk user for a local user's email address
+            models.Index(fields=["email"], name="zengo_zduser_email"),
+        ]
+
     def __str__(self):
         return "{} - {} (id={} zendesk_id={})".format(
             self.name, self.email, self.id, self.zendesk_id
@@ -56,10 +81,10 @@ class ZendeskUser(models.Model):
 
     @property
     def photo_url(self):
-        if self.photos_json:
-            j = json.loads(self.photos_json)
-            if j and isinstance(j, dict):
-                return j.get("content_url")
+        if self.photos and isinstance(self.photos, dict):
+            return self.photos.get("content_url")
+
+    photos_json = json_text_property("photos")
 
 
 class Ticket(models.Model):
@@ -87,19 +112,103 @@ class Ticket(models.Model):
     priority = ConstantChoiceCharField(
         constants=priorities, max_length=8, null=True, blank=True
     )
-    # custom fields and tags are stored here, relatively unprocessed and
-    # are None, or parseable JSON
-    custom_fields = models.TextField(null=True, blank=True)
-    tags = models.TextField(null=True, blank=True)
+    # custom fields and tags are stored here, relatively unprocessed, as JSON
+    custom_fields = models.JSONField(null=True, blank=True)
+    tags = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField()
     updated_at = models.DateTimeField(null=True, blank=True)
 
+    # high-water mark for incremental comment syncing; the newest comment
+    # sync'd and when the full comment history was last reconciled
+    last_synced_comment_id = models.BigIntegerField(null=True, blank=True)
+    comments_reconciled_at = models.DateTimeField(null=True, blank=True)
+
+    # digest of the remote data last sync'd, used to skip unchanged writes
+    fingerprint = models.CharField(max_length=32, null=True, blank=True)
+
+    custom_fields_json = json_text_property("custom_fields")
+    tags_json = json_text_property("tags")
+
     def __str__(self):
         return "{} - {} (id={} zendesk_id={})".format(
             self.subject, self.status, self.id, self.zendesk_id
         )
 
 
+class TicketTag(models.Model):
+    """A tag on a ticket, allowing tickets to be filtered by tag using an index."""
+
+    id = models.BigAutoField(primary_key=True)
+    ticket = models.ForeignKey(
+        Ticket, related_name="ticket_tags", on_delete=models.CASCADE
+    )
+    name = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ticket", "name"], name="zengo_tickettag_unique"
+            ),
+        ]
+        indexes = [
+            # tickets with a given tag
+            models.Index(fields=["name"], name="zengo_tickettag_name"),
+        ]
+
+    def __str__(self):
+        return "{} (ticket_id={})".format(self.name, self.ticket_id)
+
+
+class TicketCustomFieldValue(models.Model):
+    """
+    A value of a custom field of a ticket, allowing tickets to be filtered by
+    custom field values using an index.
+
+    Multi-select fields have a row per selected option. Empty values, and
+    those too long to index, such as from multi-line text fields, are left out
+    but remain available in `Ticket.custom_fields`.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    ticket = models.ForeignKey(
+        Ticket, related_name="custom_field_values", on_delete=models.CASCADE
+    )
+    field_id = models.BigIntegerField()
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ticket", "field_id", "value"],
+                name="zengo_customfieldvalue_unique",
+            ),
+        ]
+        indexes = [
+            # tickets with a given value for a custom field
+            models.Index(
+                fields=["field_id", "value"], name="zengo_customfieldvalue_value"
+            ),
+        ]
+
+    def __str__(self):
+        return "{}={} (ticket_id={})".format(self.field_id, self.value, self.ticket_id)
+
+    @classmethod
+    def get_values(cls, value):
+        """Return the indexable strings for a custom field's value."""
+        values = value if isinstance(value, list) else [value]
+        indexable = set()
+        for value in values:
+            if value is None or value == "":
+                continue
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            value = str(value)
+            if len(value) <= cls._meta.get_field("value").max_length:
+                indexable.add(value)
+        return indexable
+
+
 class Comment(models.Model):
 
     id = models.BigAutoField(primary_key=True)
@@ -114,6 +223,18 @@ class Comment(models.Model):
     public = models.BooleanField()
     created_at = models.DateTimeField()
 
+    # digest of the remote data last sync'd, used to skip unchanged writes
+    fingerprint = models.CharField(max_length=32, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # a ticket's comments, as snapshot when processing events, and in
+            # the order they were made, as typically listed by signal receivers
+            models.Index(
+                fields=["ticket", "created_at"], name="zengo_comment_ticket_created"
+            ),
+        ]
+
     def __str__(self):
         return "{} - {} (id={} zendesk_id={})".format(
             self.author, self.public, self.id, self.zendesk_id
@@ -140,6 +261,9 @@ class Attachment(models.Model):
         Comment, related_name="attachments", on_delete=models.CASCADE
     )
 
+    # digest of the remote data last sync'd, used to skip unchanged writes
+    fingerprint = models.CharField(max_length=32, null=True, blank=True)
+
     def __str__(self):
         return "{} (id={} zendesk_id={})".format(
             self.file_name, self.id, self.zendesk_id
@@ -163,6 +287,9 @@ class Photo(models.Model):
         Attachment, related_name="photos", on_delete=models.CASCADE
     )
 
+    # digest of the remote data last sync'd, used to skip unchanged writes
+    fingerprint = models.CharField(max_length=32, null=True, blank=True)
+
     def __str__(self):
         return "{} (id={} zendesk_id={})".format(
             self.file_name, self.id, self.zendesk_id
@@ -183,6 +310,37 @@ class Event(models.Model):
     # if processing failed, an error will appear here
     error = models.TextField(null=True, blank=True)
 
+    # events are stored pending and move through the states as processed,
+    # either inline or by a queue worker
+    states = Constants(
+        Constant(pending="pending"),
+        Constant(processing="processing"),
+        Constant(processed="processed"),
+        Constant(failed="failed"),
+        Constant(merged="merged"),
+        # failed too many times to be retried again
+        Constant(dead="dead"),
+    )
+    state = ConstantChoiceCharField(constants=states, max_length=10, default="pending")
+
+    # when a queue worker last claimed this event for processing
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    # retry bookkeeping; how many times processing has been attempted, when
+    # a failed event is next due to be retried, and what it last failed with
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error_class = models.CharField(max_length=255, null=True, blank=True)
+
+    # if coalesced with another event for the same ticket, that event
+    merged_into = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        related_name="merged_events",
+        on_delete=models.SET_NULL,
+    )
+
     # if processing succeeded, this will point at a local Ticket instance
     # with comments etc
     ticket = models.ForeignKey(
@@ -192,6 +350,35 @@ class Event(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # pending events for a ticket, when coalescing them, and a ticket's
+            # history of events
+            models.Index(
+                fields=["remote_ticket_id", "created_at"],
+                name="zengo_event_ticket_created",
+            ),
+            # claiming the oldest pending event, and pruning old events by state
+            models.Index(
+                fields=["state", "created_at"], name="zengo_event_state_created"
+            ),
+            # the admin's default ordering and date filter
+            models.Index(fields=["created_at"], name="zengo_event_created"),
+            # the admin's filter for errored events; few are, so the index is
+            # kept small by leaving out the rest
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(error__isnull=False),
+                name="zengo_event_errored",
+            ),
+            # failed events due to be retried
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(state="failed"),
+                name="zengo_event_retry_due",
+            ),
+        ]
+
     def __str__(self):
         return "{} (id={} remote_ticket_id={})".format(
             "Errored" if self.error else "Processed", self.id, self.remote_ticket_id
@@ -200,3 +387,32 @@ class Event(models.Model):
     @property
     def json(self):
         return json.loads(self.raw_data)
+
+
+class TicketLock(models.Model):
+    """
+    A row per remote ticket, locked to serialize processing of its events when
+    using `zengo.locks.RowTicketLock`.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    remote_ticket_id = models.BigIntegerField(unique=True)
+
+    def __str__(self):
+        return "Lock (remote_ticket_id={})".format(self.remote_ticket_id)
+
+
+class SyncCursor(models.Model):
+    """
+    A checkpoint in one of Zendesk's incremental exports, such that the
+    `zengo_backfill` command can resume from where it last got to.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=64, unique=True)
+    # the cursor of the next page to fetch
+    cursor = models.TextField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{} (cursor={})".format(self.name, self.cursor)
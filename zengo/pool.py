@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import multiprocessing
+import threading
+
+from django.db import connections
+
+from . import ratelimit
+from .service import get_service
+from .settings import app_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+"""
+Backfills and resyncs spend most of their time waiting on Zendesk. Here we fan
+syncing out over a pool of threads or processes, handing each worker contiguous
+ranges of ticket IDs at a time. All workers draw from the one rate limiter, so
+that the pool as a whole stays within `ZENGO_RATE_LIMIT`.
+"""
+
+_local = threading.local()
+
+
+def partition(tickets, chunk_size):
+    """Split tickets, or their IDs, into chunks of contiguous ID ranges."""
+
+    def get_id(ticket):
+        return ticket if isinstance(ticket, int) else ticket.id
+
+    tickets = sorted(tickets, key=get_id)
+    chunks = []
+    while tickets:
+        chunk, tickets = tickets[:chunk_size], tickets[chunk_size:]
+        chunks.append(chunk)
+    return chunks
+
+
+def sync_tickets(tickets, workers=None, processes=False, chunk_size=None, service=None):
+    """
+    Sync tickets across a pool of `workers` threads, or processes if
+    `processes` is set, returning the number sync'd and the number that failed.
+
+    `tickets` may be IDs, for workers to fetch, or remote tickets already
+    fetched. Only IDs can be handed to processes. With a single worker,
+    tickets are sync'd in this thread using `service`, if given.
+    """
+    workers = workers or app_settings.SYNC_CONCURRENCY
+    if processes and not all(isinstance(t, int) for t in tickets):
+        raise ValueError("Only ticket IDs can be sync'd by processes.")
+    chunks = partition(tickets, chunk_size or app_settings.SYNC_CHUNK_SIZE)
+
+    if workers <= 1:
+        service = service or get_service()
+        return _total(_sync_chunk(chunk, service) for chunk in chunks)
+
+    if processes:
+        # forked processes must not share their parent's database connections
+        connections.close_all()
+        with multiprocessing.get_context("fork").Pool(
+            workers,
+            initializer=ratelimit.set_rate_limiter,
+            initargs=(ratelimit.get_rate_limiter(),),
+        ) as process_pool:
+            return _total(process_pool.map(_sync_chunk, chunks, chunksize=1))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return _total(executor.map(_sync_chunk_in_thread, chunks))
+
+
+def _total(results):
+    synced = failed = 0
+    for chunk_synced, chunk_failed in results:
+        synced += chunk_synced
+        failed += chunk_failed
+    return synced, failed
+
+
+def _sync_chunk(chunk, service=None):
+    if service is None:
+        # each pool worker keeps its own service, and so Zenpy client
+        if getattr(_local, "service", None) is None:
+            _local.service = get_service()
+        service = _local.service
+
+    synced = failed = 0
+    for ticket in chunk:
+        try:
+            if isinstance(ticket, int):
+                service.sync_ticket_id(ticket)
+            else:
+                service.sync_ticket(ticket)
+        except Exception:
+            logger.exception(
+                "Failed to sync Zendesk ticket",
+                extra=dict(ticket_id=getattr(ticket, "id", ticket)),
+            )
+            failed += 1
+        else:
+            synced += 1
+    return synced, failed
+
+
+def _sync_chunk_in_thread(chunk):
+    try:
+        return _sync_chunk(chunk)
+    finally:
+        # pool threads have their own database connections
+        connections.close_all()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import multiprocessing
+import random
+import threading
+import time
+
+from django.core.cache import caches
+
+from .settings import app_settings
+
+
+"""
+Zendesk limits the number of API requests an account may make per minute,
+across all of its integrations. Requests made via the shared session draw from
+a token bucket, so that the aggregate rate of a process, or of a pool of them,
+stays within `ZENGO_RATE_LIMIT` requests per minute.
+
+Zendesk also tells us how many requests remain in the current window, and how
+long to back off for once we've been limited. When either demands it, all
+requests by the process are held back for a while, as are those of other
+processes and nodes sharing `ZENGO_RATE_LIMIT_CACHE`, if set.
+"""
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+# wall clock time before which no requests should be made
+_blocked_until = 0.0
+_blocked_lock = threading.Lock()
+
+BLOCKED_UNTIL_KEY = "zengo:rate-limit:blocked-until"
+
+# proportion of a wait randomly added to it, so that waiting workers don't
+# all resume at once
+JITTER = 0.2
+
+
+class TokenBucket(object):
+    """
+    Allow `rate` acquisitions per second on average, in bursts of up to
+    `capacity`.
+
+    State is kept in shared memory, so a bucket is shared by threads and by
+    processes that inherit it, whether by forking or as a process argument.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(self.rate, 1))
+        self._lock = multiprocessing.Lock()
+        self._tokens = multiprocessing.Value("d", self.capacity, lock=False)
+        self._updated = multiprocessing.Value("d", time.monotonic(), lock=False)
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def take(self):
+        """
+        Take a token if one is available, returning 0, or else the seconds to
+        wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens.value = min(
+                self.capacity,
+                self._tokens.value + (now - self._updated.value) * self.rate,
+            )
+            self._updated.value = now
+            if self._tokens.value >= 1:
+                self._tokens.value -= 1
+                return 0
+            return (1 - self._tokens.value) / self.rate
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide token bucket, or None if `ZENGO_RATE_LIMIT` isn't
+    set.
+    """
+    global _limiter
+    if _limiter is None and app_settings.RATE_LIMIT:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = TokenBucket(app_settings.RATE_LIMIT / 60.0)
+    return _limiter
+
+
+def set_rate_limiter(limiter):
+    """Replace the process-wide token bucket, such as with one from a parent."""
+    global _limiter
+    _limiter = limiter
+
+
+def _get_cache():
+    if app_settings.RATE_LIMIT_CACHE is None:
+        return None
+    return caches[app_settings.RATE_LIMIT_CACHE]
+
+
+def block(seconds):
+    """Hold back requests for `seconds`, across nodes if so configured."""
+    global _blocked_until
+    until = time.time() + seconds
+    with _blocked_lock:
+        _blocked_until = max(_blocked_until, until)
+    cache = _get_cache()
+    if cache is not None:
+        cache.set(BLOCKED_UNTIL_KEY, until, int(seconds) + 1)
+
+
+def get_wait_delay():
+    """Return the seconds to wait out any block on requests, with jitter."""
+    until = _blocked_until
+    cache = _get_cache()
+    if cache is not None:
+        until = max(until, cache.get(BLOCKED_UNTIL_KEY, 0))
+    delay = until - time.time()
+    if delay <= 0:
+        return 0
+    return delay * (1 + random.uniform(0, JITTER))
+
+
+def wait():
+    """Wait out any block on requests, with jitter."""
+    delay = get_wait_delay()
+    if delay:
+        time.sleep(delay)
+
+
+def _get_header(response, *names):
+    for name in names:
+        try:
+            return int(response.headers[name])
+        except (KeyError, ValueError):
+            continue
+    return None
+
+
+def get_retry_delay(response, attempt):
+    """
+    Return the seconds to wait before retrying a rate limited request, as told
+    by Zendesk or else backing off exponentially.
+    """
+    retry_after = _get_header(response, "Retry-After")
+    if retry_after is None:
+        return app_settings.RATE_LIMIT_BACKOFF * 2**attempt
+    return retry_after
+
+
+def get_throttle_delay(response):
+    """
+    Return the seconds to hold back further requests for, spreading those
+    remaining in the current rate limit window once few are left.
+    """
+    remaining = _get_header(response, "X-Rate-Limit-Remaining", "ratelimit-remaining")
+    if remaining is None or remaining > app_settings.RATE_LIMIT_RESERVE:
+        return 0
+    reset = _get_header(response, "ratelimit-reset") or 60
+    return reset / (remaining + 1.0)
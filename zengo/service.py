@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import contextlib
+from datetime import timedelta
+import functools
 import importlib
 import json
 import logging
@@ -10,14 +14,19 @@ import traceback
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.forms.models import model_to_dict
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 
-from zenpy import Zenpy
 from zenpy.lib.api_objects import User as RemoteZendeskUser
 from zenpy.lib.exception import APIException
 
-from . import models, signals, strings
+from . import bulk, locks, models, signals, strings
+from .client import get_client
 from .settings import app_settings
 
 
@@ -43,16 +52,79 @@ by the API wrapper, Zenpy.
 """
 
 
+# fields recording our sync'ing of a ticket, rather than its data
+SYNC_STATE_FIELDS = ("fingerprint", "last_synced_comment_id", "comments_reconciled_at")
+
+# fields which change too routinely, or are too mismatched in type between
+# the API and the database, to usefully report changes to
+UNREPORTED_FIELDS = ("created_at", "updated_at") + SYNC_STATE_FIELDS
+
+# the special Zendesk user, cached per database
+_special_zendesk_users = {}
+
+
+@receiver(post_delete, sender=models.ZendeskUser)
+def forget_special_zendesk_user(sender, instance, using, **kwargs):
+    if instance.zendesk_id == -1:
+        _special_zendesk_users.pop(using, None)
+
+
+class TicketChanges(object):
+    """
+    What a sync of a ticket wrote: the old and new values of each of the
+    ticket's fields that changed, and the comments and attachments which were
+    created or updated.
+    """
+
+    def __init__(self):
+        self.updated_fields = {}
+        self.new_comments = []
+        self.updated_comments = []
+        self.new_attachments = []
+        self.updated_attachments = []
+
+
+class SyncResult(tuple):
+    """
+    The `(ticket, created)` pair returned by a sync, plus its `changes`.
+    """
+
+    def __new__(cls, ticket, created, changes):
+        result = super(SyncResult, cls).__new__(cls, (ticket, created))
+        result.changes = changes
+        return result
+
+    @property
+    def ticket(self):
+        return self[0]
+
+    @property
+    def created(self):
+        return self[1]
+
+
 class ZengoService(object):
     """Encapsulate behaviour allowing easy customisation."""
 
     def __init__(self, *args, **kwargs):
-        creds = {
-            "email": settings.ZENDESK_EMAIL,
-            "token": settings.ZENDESK_TOKEN,
-            "subdomain": settings.ZENDESK_SUBDOMAIN,
-        }
-        self.client = Zenpy(**creds)
+        self.client = self.create_client()
+        # rows actually written by syncs, per model
+        self.write_counts = Counter()
+
+    def create_client(self):
+        """
+        Return a new Zenpy client; by default one sharing a pooled,
+        process-wide HTTP session. Override to configure your own.
+        """
+        return get_client()
+
+    def get_ticket_client(self):
+        """
+        Return a client with which to fetch a ticket concurrently with its
+        comments, as Zenpy's object cache, and so `self.client`, isn't
+        thread-safe.
+        """
+        return self.create_client()
 
     # extraction of data from local users for injection into Zendesk
 
@@ -68,6 +140,27 @@ class ZengoService(object):
     def get_local_user_for_external_id(self, external_id):
         return get_user_model().objects.filter(id=external_id).first()
 
+    def get_local_users_for_external_ids(self, external_ids):
+        """
+        Return a mapping of the given external IDs to local users, or None
+        where no local user matches, resolving all of them in one query.
+
+        Should `get_local_user_for_external_id` be overridden, it is instead
+        used to resolve each external ID in turn.
+        """
+        external_ids = set(external_ids)
+        if (
+            type(self).get_local_user_for_external_id
+            is not ZengoService.get_local_user_for_external_id
+        ):
+            return {e: self.get_local_user_for_external_id(e) for e in external_ids}
+
+        lookup_ids = [e for e in external_ids if e is not None]
+        local_users = {
+            str(u.id): u for u in get_user_model().objects.filter(id__in=lookup_ids)
+        }
+        return {e: local_users.get(str(e)) for e in external_ids}
+
     def get_remote_zd_user_for_local_user(self, local_user):
         """
         Attempt to resolve the provided user to an extant Zendesk User.
@@ -135,7 +228,17 @@ class ZengoService(object):
         """
         Return a ZendeskUser instance representing the special Zendesk user that
         automations can add use to add comments.
+
+        Once its row is known to be committed, the instance is cached for the
+        life of the process, or until the row is deleted. Should the row be
+        deleted without this process knowing, a sync failing as a result
+        forgets the instance and is retried.
         """
+        db = router.db_for_write(models.ZendeskUser)
+        instance = _special_zendesk_users.get(db)
+        if instance is not None:
+            return instance
+
         instance, created = models.ZendeskUser.objects.get_or_create(
             zendesk_id=-1,
             defaults=dict(
@@ -145,6 +248,10 @@ class ZengoService(object):
                 created_at=timezone.now(),
             ),
         )
+        # caching a row that is then rolled back would break later syncs
+        transaction.on_commit(
+            lambda: _special_zendesk_users.__setitem__(db, instance), using=db
+        )
         return instance
 
     def update_remote_zd_user_for_local_user(self, local_user, remote_zd_user):
@@ -196,15 +303,25 @@ class ZengoService(object):
             remote_zd_user = self.create_remote_zd_user_for_local_user(local_user)
         return remote_zd_user
 
-    def sync_user(self, remote_zd_user):
+    def sync_user(self, remote_zd_user, local_users=None):
         """
         Given a RemoteZendeskUser instance, persist it as a local ZendeskUser instance.
+
+        Optionally, pass a mapping of external IDs to local users as returned by
+        `get_local_users_for_external_ids` to avoid resolving the local user here.
         """
-        instance, created = models.ZendeskUser.objects.update_or_create(
+        if local_users is None:
+            # attempt to resolve the local user if possible
+            user = self.get_local_user_for_external_id(remote_zd_user.external_id)
+        else:
+            user = local_users.get(remote_zd_user.external_id)
+
+        instance, created = bulk.update_or_create(
+            models.ZendeskUser,
             zendesk_id=remote_zd_user.id,
+            counter=self.write_counts,
             defaults=dict(
-                # attempt to resolve the local user if possible
-                user=self.get_local_user_for_external_id(remote_zd_user.external_id),
+                user=user,
                 alias=remote_zd_user.alias,
                 email=remote_zd_user.email,
                 created_at=remote_zd_user.created_at,
@@ -212,55 +329,269 @@ class ZengoService(object):
                 active=remote_zd_user.active,
                 role=remote_zd_user.role,
                 # store their latest photo JSON data
-                photos_json=json.dumps(remote_zd_user.photo),
+                photos=remote_zd_user.photo,
             ),
         )
         return instance
 
+    def get_remote_comments(self, remote_zd_ticket):
+        """
+        Fetch the comments of a remote ticket which need syncing, oldest first.
+
+        Returns the comments along with a boolean indicating whether they are
+        the ticket's full comment history. In incremental mode, comments are
+        paged newest first and paging stops once the newest comment already
+        sync'd is reached, unless a periodic full reconcile is due.
+
+        Comment authors are sideloaded into the client's user cache.
+        """
+        is_full_history, last_synced_comment_id = self.get_comment_sync_state(
+            remote_zd_ticket.id
+        )
+        remote_comments = self.fetch_remote_comments(
+            remote_zd_ticket.id, is_full_history, last_synced_comment_id
+        )
+        return remote_comments, is_full_history
+
+    def fetch_remote_comments(self, ticket_id, is_full_history, last_synced_comment_id):
+        """
+        Fetch the comments of a remote ticket, oldest first, stopping at
+        `last_synced_comment_id` unless the full history is wanted.
+        """
+        params = dict(include_inline_images="true", include="users")
+        if not is_full_history:
+            # comments are cursor paginated, which ignores `sort_order`
+            params["sort"] = "-created_at"
+
+        # `TicketApi.comments` doesn't accept sideloading or sorting parameters
+        results = self.client.tickets._query_zendesk(
+            self.client.tickets.endpoint.comments, "comment", id=ticket_id, **params
+        )
+
+        if is_full_history:
+            remote_comments = list(results)
+        else:
+            remote_comments = list(take_new_comments(results, last_synced_comment_id))
+        remote_comments.sort(key=lambda c: (c.created_at, c.id))
+        return remote_comments
+
+    def get_comment_sync_state(self, ticket_id):
+        """
+        Return whether a ticket's full comment history must be fetched, and if
+        not, the ID of the newest comment already sync'd.
+        """
+        local_ticket = None
+        if app_settings.INCREMENTAL_COMMENT_SYNC:
+            local_ticket = (
+                models.Ticket.objects.filter(zendesk_id=ticket_id)
+                .only("last_synced_comment_id", "comments_reconciled_at")
+                .first()
+            )
+        if not local_ticket or self.comment_reconcile_due(local_ticket):
+            return True, None
+        return False, local_ticket.last_synced_comment_id
+
+    def get_remote_users(self, user_ids):
+        """
+        Return a mapping of the given IDs to RemoteZendeskUser instances.
+
+        Users already sideloaded are taken from the client's cache, and any
+        others are fetched using a single `show_many` request per hundred users,
+        rather than a request per user.
+        """
+        remote_users = {}
+        missing_ids = []
+        for user_id in sorted(set(user_ids)):
+            remote_zd_user = self.client.cache.get("user", user_id)
+            if remote_zd_user is None:
+                missing_ids.append(user_id)
+            else:
+                remote_users[user_id] = remote_zd_user
+
+        while missing_ids:
+            batch, missing_ids = missing_ids[:100], missing_ids[100:]
+            for remote_zd_user in self.client.users(ids=batch):
+                remote_users[remote_zd_user.id] = remote_zd_user
+        return remote_users
+
+    def comment_reconcile_due(self, local_ticket):
+        """Determine whether a ticket's full comment history must be fetched."""
+        if local_ticket.last_synced_comment_id is None:
+            return True
+        if local_ticket.comments_reconciled_at is None:
+            return True
+        interval = timedelta(seconds=app_settings.COMMENT_RECONCILE_INTERVAL)
+        return local_ticket.comments_reconciled_at + interval <= timezone.now()
+
+    def get_incremental_tickets(self, start_time=None, cursor=None):
+        """
+        Fetch a page of Zendesk's cursor based incremental ticket export,
+        beginning at either a unix `start_time` or a `cursor` from a prior page.
+
+        Returns the tickets, the cursor of the following page, and whether the
+        end of the export has been reached. Requesters are sideloaded into
+        the client's user cache.
+        """
+        if cursor:
+            results = self.client.tickets.incremental(cursor=cursor, include="users")
+        else:
+            results = self.client.tickets.incremental(
+                start_time=start_time or 0, include="users"
+            )
+        # the generator would otherwise page onwards without giving us the
+        # cursors we need to checkpoint
+        page = results._response_json
+        return (
+            results.values or [],
+            page.get("after_cursor"),
+            page.get("end_of_stream", True),
+        )
+
     def sync_ticket_id(self, ticket_id):
-        return self.sync_ticket(self.client.tickets(id=ticket_id))
+        """
+        Fetch a ticket and its comments from Zendesk concurrently, and sync
+        them using `sync_ticket`.
+        """
+        is_full_history, last_synced_comment_id = self.get_comment_sync_state(ticket_id)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            ticket_future = executor.submit(
+                self.get_ticket_client().tickets, id=ticket_id
+            )
+            remote_comments = self.fetch_remote_comments(
+                ticket_id, is_full_history, last_synced_comment_id
+            )
+            remote_zd_ticket = ticket_future.result()
+        return self.sync_ticket(
+            remote_zd_ticket,
+            remote_comments=remote_comments,
+            is_full_history=is_full_history,
+        )
 
-    def sync_ticket(self, remote_zd_ticket):
+    def sync_ticket(self, remote_zd_ticket, remote_comments=None, is_full_history=None):
         """
         Create or update local representations of a Zendesk ticket, its comments
         and all associated Zendesk users.
 
-        This uses `update_or_create` to avoid integrity errors, demanding that
-        comments and users be sync'd in a consistent order to avoid deadlock.
+        This uses `update_or_create` for users and the ticket, and bulk upserts
+        keyed on `zendesk_id` for comments, attachments and photos, demanding
+        that rows be sync'd in a consistent order to avoid deadlock. Rows whose
+        remote data is unchanged since they were last sync'd aren't rewritten.
+
+        When `ZENGO_INCREMENTAL_COMMENT_SYNC` is enabled, only comments beyond
+        those we've already got in the database are pulled and written.
 
-        Todo: only pull comments beyond those we've already got in the database
+        Everything needed is fetched from Zendesk before any writes are made,
+        and the writes are then made in a single transaction, such that a
+        ticket is sync'd in full or not at all, with row locks held only for as
+        long as the writes take.
+
+        The ticket's comments are fetched here, unless already fetched and
+        given along with whether they're its full history.
+
+        Returns a `SyncResult`, which unpacks as `(ticket, created)` and
+        reports what was written as its `changes`.
         """
+        if remote_comments is None:
+            remote_comments, is_full_history = self.get_remote_comments(
+                remote_zd_ticket
+            )
 
-        kwargs = dict(include_inline_images=True)
+        # resolve the distinct Zendesk users involved, in at most one request
+        remote_users = self.get_remote_users(
+            [remote_zd_ticket.requester_id]
+            + [c.author_id for c in remote_comments if c.author_id != -1]  # noqa
+        )
 
-        remote_comments = [
-            c for c in self.client.tickets.comments(remote_zd_ticket.id, **kwargs)
-        ]
+        return self.persist_ticket(
+            remote_zd_ticket, remote_comments, is_full_history, remote_users
+        )
 
-        remote_comments.sort(key=lambda c: (c.created_at, c.id))
+    def persist_ticket(
+        self, remote_zd_ticket, remote_comments, is_full_history, remote_users
+    ):
+        """
+        Write a Zendesk ticket, its comments and users as fetched from Zendesk
+        in a single transaction, without making any further requests of it.
+        """
+        written = Counter(self.write_counts)
+
+        def write():
+            self.write_counts.clear()
+            self.write_counts.update(written)
+            with transaction.atomic(using=router.db_for_write(models.Ticket)):
+                locks.acquire_deferred_lock(remote_zd_ticket.id)
+                # a concurrent sync may have fetched the ticket later, yet
+                # written it first; don't overwrite its data with older data
+                newer_ticket = self.get_newer_local_ticket(remote_zd_ticket)
+                if newer_ticket is not None:
+                    logger.debug(
+                        "Skipped writing stale Zendesk ticket",
+                        extra=dict(ticket_id=remote_zd_ticket.id),
+                    )
+                    return SyncResult(newer_ticket, False, TicketChanges())
+                return self.write_ticket(
+                    remote_zd_ticket, remote_comments, is_full_history, remote_users
+                )
 
-        # establish a distinct, ordered list of Zendesk users
-        users = set(
-            [remote_zd_ticket.requester]
-            + [c.author for c in remote_comments if c.author_id != -1]  # noqa
+        try:
+            try:
+                result = write()
+            except IntegrityError:
+                # the special Zendesk user may have been deleted since it was
+                # cached, such as by another process; forget it and try again
+                db = router.db_for_write(models.ZendeskUser)
+                if _special_zendesk_users.pop(db, None) is None:
+                    raise
+                result = write()
+        except Exception:
+            # nothing was written after all
+            self.write_counts.clear()
+            self.write_counts.update(written)
+            raise
+
+        logger.debug(
+            "Sync'd Zendesk ticket",
+            extra=dict(
+                ticket_id=remote_zd_ticket.id,
+                rows_written=dict(self.write_counts - written),
+            ),
         )
-        users = list(users)
-        users.sort(key=lambda u: u.id)
+        return result
 
-        # sync the users and establish a mapping to local records
-        user_map = {u: self.sync_user(u) for u in users}
+    def write_ticket(
+        self, remote_zd_ticket, remote_comments, is_full_history, remote_users
+    ):
+        changes = TicketChanges()
+
+        # link the users to local users with a single query
+        local_users = self.get_local_users_for_external_ids(
+            [u.external_id for u in remote_users.values()]
+        )
+
+        # sync the users in a consistent order and map their IDs to local records
+        user_map = {
+            user_id: self.sync_user(remote_users[user_id], local_users=local_users)
+            for user_id in sorted(remote_users)
+        }
 
         defaults = dict(
-            requester=user_map[remote_zd_ticket.requester],
+            requester=user_map[remote_zd_ticket.requester_id],
             subject=remote_zd_ticket.subject,
             url=remote_zd_ticket.url,
             status=models.Ticket.states.by_id.get(remote_zd_ticket.status.lower()),
-            custom_fields=json.dumps(remote_zd_ticket.custom_fields),
-            tags=json.dumps(remote_zd_ticket.tags),
+            custom_fields=remote_zd_ticket.custom_fields,
+            tags=remote_zd_ticket.tags,
             created_at=remote_zd_ticket.created_at,
             updated_at=remote_zd_ticket.updated_at,
         )
 
+        # advance the high-water mark used by incremental comment syncing
+        state = {}
+        if remote_comments:
+            state["last_synced_comment_id"] = max(c.id for c in remote_comments)
+        if is_full_history and app_settings.INCREMENTAL_COMMENT_SYNC:
+            state["comments_reconciled_at"] = timezone.now()
+
         # In some API responses we don't get a priority, but it could be an existing ticket with
         # priority already initialised so we don't want to overwrite the priority to the Ticket
         # object.
@@ -270,24 +601,42 @@ class ZengoService(object):
             )
 
         # update or create the ticket
-        local_ticket, created = models.Ticket.objects.update_or_create(
+        updated_fields = {}
+        local_ticket, created = bulk.update_or_create(
+            models.Ticket,
             zendesk_id=remote_zd_ticket.id,
+            counter=self.write_counts,
+            changes=updated_fields,
             defaults=defaults,
+            state=state,
+        )
+        changes.updated_fields = {
+            name: change
+            for name, change in updated_fields.items()
+            if name not in UNREPORTED_FIELDS
+        }
+        self.sync_ticket_tags(local_ticket, remote_zd_ticket.tags)
+        self.sync_ticket_custom_field_values(
+            local_ticket, remote_zd_ticket.custom_fields
         )
-        # and now update or create the comments - baring in mind some might be type `VoiceComment`
+
+        # and now build the comments - baring in mind some might be type `VoiceComment`
         # https://developer.zendesk.com/rest_api/docs/support/ticket_audits#voice-comment-event
+        local_comments = []
+        local_attachments = []
+        local_photos = []
         for remote_comment in remote_comments:
             # if we know Zendesk created this comment as part of an automation or
             # merge, link it to the Zendesk user (skipping any zenpy/network hits)
             if remote_comment.author_id == -1:
                 author = self.get_special_zendesk_user()
             else:
-                author = user_map[remote_comment.author]
+                author = user_map[remote_comment.author_id]
 
-            local_comment, _created = models.Comment.objects.update_or_create(
-                zendesk_id=remote_comment.id,
-                ticket=local_ticket,
-                defaults=dict(
+            local_comments.append(
+                models.Comment(
+                    zendesk_id=remote_comment.id,
+                    ticket=local_ticket,
                     author=author,
                     body=remote_comment.body,
                     html_body=remote_comment.html_body,
@@ -295,37 +644,160 @@ class ZengoService(object):
                     plain_body=getattr(remote_comment, "plain_body", None),
                     public=remote_comment.public,
                     created_at=remote_comment.created_at,
-                ),
+                )
             )
             for attachment in remote_comment.attachments:
-                local_attachment, _created = models.Attachment.objects.update_or_create(
-                    zendesk_id=attachment.id,
-                    comment=local_comment,
-                    defaults=dict(
-                        file_name=attachment.file_name,
-                        content_url=attachment.content_url,
-                        content_type=attachment.content_type,
-                        size=attachment.size,
-                        width=attachment.width,
-                        height=attachment.height,
-                        inline=attachment.inline,
-                    ),
+                # parents are linked up once their primary keys are known
+                local_attachments.append(
+                    (
+                        remote_comment.id,
+                        models.Attachment(
+                            zendesk_id=attachment.id,
+                            file_name=attachment.file_name,
+                            content_url=attachment.content_url,
+                            content_type=attachment.content_type,
+                            size=attachment.size,
+                            width=attachment.width,
+                            height=attachment.height,
+                            inline=attachment.inline,
+                        ),
+                    )
                 )
                 for photo in attachment.thumbnails:
-                    local_photo, _created = models.Photo.objects.update_or_create(
-                        zendesk_id=photo.id,
-                        attachment=local_attachment,
-                        defaults=dict(
-                            file_name=photo.file_name,
-                            content_url=photo.content_url,
-                            content_type=photo.content_type,
-                            size=photo.size,
-                            width=photo.width,
-                            height=photo.height,
-                        ),
+                    local_photos.append(
+                        (
+                            attachment.id,
+                            models.Photo(
+                                zendesk_id=photo.id,
+                                file_name=photo.file_name,
+                                content_url=photo.content_url,
+                                content_type=photo.content_type,
+                                size=photo.size,
+                                width=photo.width,
+                                height=photo.height,
+                            ),
+                        )
                     )
 
-        return local_ticket, created
+        # persist each level of the comment tree with a few bulk statements
+        comment_pks = bulk.upsert(
+            models.Comment,
+            local_comments,
+            counter=self.write_counts,
+            created=changes.new_comments,
+            updated=changes.updated_comments,
+        )
+        for comment_id, local_attachment in local_attachments:
+            local_attachment.comment_id = comment_pks[comment_id]
+        attachment_pks = bulk.upsert(
+            models.Attachment,
+            [a for _id, a in local_attachments],
+            counter=self.write_counts,
+            created=changes.new_attachments,
+            updated=changes.updated_attachments,
+        )
+        for attachment_id, local_photo in local_photos:
+            local_photo.attachment_id = attachment_pks[attachment_id]
+        bulk.upsert(
+            models.Photo, [p for _id, p in local_photos], counter=self.write_counts
+        )
+
+        return SyncResult(local_ticket, created, changes)
+
+    def get_newer_local_ticket(self, remote_zd_ticket):
+        """
+        Return the local ticket should it have been sync'd from data newer than
+        that of `remote_zd_ticket`, or None.
+        """
+        remote_updated_at = remote_zd_ticket.updated
+        if remote_updated_at is None:
+            return None
+        if not settings.USE_TZ:
+            remote_updated_at = timezone.make_naive(remote_updated_at)
+        return models.Ticket.objects.filter(
+            zendesk_id=remote_zd_ticket.id, updated_at__gt=remote_updated_at
+        ).first()
+
+    def sync_ticket_tags(self, local_ticket, tags):
+        """
+        Bring the TicketTag rows of a ticket in line with its tags, writing only
+        those added or removed.
+        """
+        wanted = {name for name in tags or [] if len(name) <= 255}
+        existing = set(local_ticket.ticket_tags.values_list("name", flat=True))
+        self._apply_row_changes(
+            models.TicketTag,
+            local_ticket.ticket_tags.filter(name__in=existing - wanted),
+            [
+                models.TicketTag(ticket=local_ticket, name=name)
+                for name in sorted(wanted - existing)
+            ],
+        )
+
+    def sync_ticket_custom_field_values(self, local_ticket, custom_fields):
+        """
+        Bring the TicketCustomFieldValue rows of a ticket in line with its custom
+        fields, writing only those values added or removed.
+        """
+        wanted = {
+            (field["id"], value)
+            for field in custom_fields or []
+            for value in models.TicketCustomFieldValue.get_values(field.get("value"))
+        }
+        existing_rows = dict(
+            ((field_id, value), pk)
+            for pk, field_id, value in local_ticket.custom_field_values.values_list(
+                "pk", "field_id", "value"
+            )
+        )
+        self._apply_row_changes(
+            models.TicketCustomFieldValue,
+            models.TicketCustomFieldValue.objects.filter(
+                pk__in=[pk for key, pk in existing_rows.items() if key not in wanted]
+            ),
+            [
+                models.TicketCustomFieldValue(
+                    ticket=local_ticket, field_id=field_id, value=value
+                )
+                for field_id, value in sorted(wanted - set(existing_rows))
+            ],
+        )
+
+    def _apply_row_changes(self, model, removed, added):
+        deleted, _per_model = removed.delete()
+        if added:
+            model.objects.bulk_create(added)
+        if deleted or added:
+            self.write_counts[model._meta.model_name] += deleted + len(added)
+
+
+def take_new_comments(remote_comments, last_synced_comment_id):
+    """
+    Yield those of `remote_comments`, requested newest first, which are newer
+    than `last_synced_comment_id`.
+
+    Zendesk comment IDs increase monotonically, so iteration stops at an older
+    comment only once the comments are seen to be arriving newest first;
+    should they arrive in any other order, older comments are skipped instead.
+    """
+    previous_id = None
+    for remote_comment in remote_comments:
+        if remote_comment.id > last_synced_comment_id:
+            yield remote_comment
+        elif previous_id is not None and previous_id > remote_comment.id:
+            return
+        previous_id = remote_comment.id
+
+
+def get_lazy_comments(ticket, comment_ids):
+    """Return a list of a ticket's comments, loaded only once first used."""
+    return SimpleLazyObject(
+        lambda: list(
+            ticket.comments.filter(zendesk_id__in=comment_ids).order_by(
+                "created_at", "pk"
+            )
+        )
+    )
 
 
 class ZengoProcessor(object):
@@ -336,52 +808,216 @@ class ZengoProcessor(object):
     asynchronously, etc.
     """
 
-    def store_event(self, data):
-        """Take raw request body and parse then store an event."""
-        event = models.Event.objects.create(raw_data=data)
-        event.save()
+    # the service shared by events being processed together, if any
+    service = None
+
+    def parse_event_data(self, data):
         try:
-            data = json.loads(data)
+            return json.loads(data)
         except (TypeError, ValueError):
             raise ValidationError(strings.data_malformed)
 
+    def store_event(self, data):
+        """
+        Take raw request body and parse then store an event.
+
+        The body is validated before anything is stored, such that malformed
+        requests cost no writes.
+        """
+        parsed = self.parse_event_data(data)
+
         # minimum we need to be able to process the update is
         # a remote ZD ticket ID
         try:
-            int(data["id"])
-        except KeyError:
-            raise ValidationError(strings.data_no_ticket_id)
-        except ValueError:
+            ticket_id = int(parsed["id"])
+        except (KeyError, TypeError, ValueError):
             raise ValidationError(strings.data_no_ticket_id)
 
-        event.remote_ticket_id = data["id"]
-        event.save(update_fields=("remote_ticket_id", "updated_at"))
-        return event
+        return models.Event.objects.create(raw_data=data, remote_ticket_id=ticket_id)
+
+    def store_events(self, data):
+        """
+        Take raw request body and parse then store its events: one for a body
+        of `{"id": ...}`, or one per distinct ticket for a batch of
+        `{"ids": [...]}`, of at most `ZENGO_WEBHOOK_MAX_BATCH_SIZE` tickets.
+        """
+        parsed = self.parse_event_data(data)
+        if not isinstance(parsed, dict) or "ids" not in parsed:
+            return [self.store_event(data)]
+
+        ticket_ids = []
+        if isinstance(parsed["ids"], list):
+            try:
+                ticket_ids = [int(ticket_id) for ticket_id in parsed["ids"]]
+            except (TypeError, ValueError):
+                pass
+        if not ticket_ids:
+            raise ValidationError(strings.data_no_ticket_ids)
+
+        # each ticket need only be sync'd once
+        ticket_ids = list(dict.fromkeys(ticket_ids))
+        max_size = app_settings.WEBHOOK_MAX_BATCH_SIZE
+        if max_size is not None and len(ticket_ids) > max_size:
+            raise ValidationError(strings.data_too_many_ticket_ids.format(max_size))
+
+        # each event is stored as though it were received alone
+        return self.create_events(
+            [
+                models.Event(
+                    raw_data=json.dumps({"id": ticket_id}), remote_ticket_id=ticket_id
+                )
+                for ticket_id in ticket_ids
+            ]
+        )
+
+    def create_events(self, events):
+        """Insert unsaved events, using a single statement where possible."""
+        db = router.db_for_write(models.Event)
+        if connections[db].features.can_return_rows_from_bulk_insert:
+            return models.Event.objects.using(db).bulk_create(events)
+        # otherwise primary keys wouldn't be set, so insert one at a time
+        for event in events:
+            event.save(using=db)
+        return events
 
     def begin_processing_event(self, event):
         return self.process_event_and_record_errors(event)
 
+    def begin_processing_events(self, events):
+        """
+        Begin processing events received together, sharing a service, and so a
+        Zendesk client, between them.
+
+        Every event is processed even should some fail, the first failure then
+        being raised.
+        """
+        self.service = get_service()
+        error = None
+        try:
+            for event in events:
+                try:
+                    self.begin_processing_event(event)
+                except Exception as e:
+                    error = error or e
+        finally:
+            self.service = None
+        if error is not None:
+            raise error
+
     def process_event_and_record_errors(self, event):
+        event.attempts += 1
         try:
             # potentially serialize processing per-ticket such that there isn't
             # doubling up on signals firing
             with self.acquire_ticket_lock(event.remote_ticket_id):
                 self.process_event(event)
+            self.record_event_processed(event)
 
-        except Exception:
-            logger.exception(
-                "Failed to process Zendesk event",
-                extra=dict(
-                    event_id=event.id,
-                ),
-            )
-            # Attempt to store a traceback in our DB for convenience and legacy's sake.
-            # The earlier call to `logger.exception` should be ideally surfaced via dev
-            # error reporting (Sentry, etc)
-            event.error = traceback.format_exc()
-            event.save(update_fields=("error", "updated_at"))
+        except Exception as e:
+            self.record_event_failed(event, e)
             raise
 
+    def record_event_processed(self, event):
+        event.state = models.Event.states.processed
+        event.next_attempt_at = None
+        # an event recovering on retry no longer shows as errored
+        event.error = None
+        event.last_error_class = None
+        event.save(
+            update_fields=(
+                "error",
+                "state",
+                "attempts",
+                "next_attempt_at",
+                "last_error_class",
+                "updated_at",
+            )
+        )
+
+    def record_event_failed(self, event, error):
+        logger.error(
+            "Failed to process Zendesk event",
+            exc_info=error,
+            extra=dict(
+                event_id=event.id,
+            ),
+        )
+        # Attempt to store a traceback in our DB for convenience and legacy's sake.
+        # The earlier call to `logger.error` should be ideally surfaced via dev
+        # error reporting (Sentry, etc)
+        event.error = "".join(
+            traceback.format_exception(type(error), error, error.__traceback__)
+        )
+        event.last_error_class = "{}.{}".format(
+            type(error).__module__, type(error).__qualname__
+        )
+        # schedule a retry, unless we've tried enough times already
+        if event.attempts >= app_settings.RETRY_MAX_ATTEMPTS:
+            event.state = models.Event.states.dead
+            event.next_attempt_at = None
+        else:
+            event.state = models.Event.states.failed
+            event.next_attempt_at = timezone.now() + timedelta(
+                seconds=self.get_retry_delay(event)
+            )
+        event.save(
+            update_fields=(
+                "error",
+                "state",
+                "attempts",
+                "next_attempt_at",
+                "last_error_class",
+                "updated_at",
+            )
+        )
+
+    def get_retry_delay(self, event):
+        """Return the seconds to wait before retrying a failed event."""
+        return min(
+            app_settings.RETRY_BACKOFF * 2 ** (event.attempts - 1),
+            app_settings.RETRY_BACKOFF_MAX,
+        )
+
+    def retry_due_events(self, limit=None):
+        """
+        Process failed events whose next attempt is due, oldest first, returning
+        how many were retried.
+
+        Events claimed over `ZENGO_QUEUE_CLAIM_TIMEOUT` seconds ago yet still
+        processing, their processor seemingly having died, are retried too.
+
+        Each event is claimed with a conditional update, so that concurrent
+        callers never retry the same event. Failures are recorded against the
+        events, which are rescheduled or dead-lettered accordingly.
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=app_settings.QUEUE_CLAIM_TIMEOUT)
+        failed = Q(state=models.Event.states.failed, next_attempt_at__lte=now)
+        abandoned = Q(state=models.Event.states.processing, claimed_at__lt=stale)
+        due = models.Event.objects.filter(failed | abandoned).order_by(
+            "next_attempt_at", "id"
+        )[:limit]
+
+        retried = 0
+        for event in due:
+            now = timezone.now()
+            claimed = models.Event.objects.filter(
+                id=event.id,
+                state=event.state,
+                next_attempt_at=event.next_attempt_at,
+                claimed_at=event.claimed_at,
+            ).update(
+                state=models.Event.states.processing, claimed_at=now, updated_at=now
+            )
+            if not claimed:
+                continue
+            retried += 1
+            try:
+                self.process_event_and_record_errors(event)
+            except Exception:
+                pass
+        return retried
+
     def process_event(self, event):
         """
         At this stage we have a JSON structure - process it.
@@ -392,25 +1028,43 @@ class ZengoProcessor(object):
         """
         ticket_id = event.remote_ticket_id
 
-        # take a snapshot of the ticket and its comments in their old state
-        pre_sync_ticket = models.Ticket.objects.filter(zendesk_id=ticket_id).first()
-        pre_sync_comments = []
-        if pre_sync_ticket:
-            pre_sync_comments = list(pre_sync_ticket.comments.all())
+        # take a snapshot of the ticket in its old state
+        pre_sync_ticket = self.get_pre_sync_ticket(ticket_id)
 
-        post_sync_ticket, created = get_service().sync_ticket_id(ticket_id)
+        result = (self.service or get_service()).sync_ticket_id(ticket_id)
+        self.send_ticket_signals(pre_sync_ticket, result)
 
-        post_sync_comments = list(post_sync_ticket.comments.all())
+    def get_pre_sync_ticket(self, ticket_id):
+        return models.Ticket.objects.filter(zendesk_id=ticket_id).first()
+
+    def send_ticket_signals(self, pre_sync_ticket, result):
+        """Fire `ticket_created` or `ticket_updated` for a ticket just sync'd."""
+        post_sync_ticket, created = result
+
+        # comments are never removed by a sync, so those the ticket had before
+        # are those it has now, less any the sync created
+        post_comment_ids = set(
+            post_sync_ticket.comments.values_list("zendesk_id", flat=True)
+        )
+        pre_comment_ids = set()
+        if pre_sync_ticket:
+            pre_comment_ids = post_comment_ids - set(
+                c.zendesk_id for c in result.changes.new_comments
+            )
 
-        # build update context for passing downstream
+        # build update context for passing downstream, only loading full
+        # comment lists should a receiver use them
         update_context = {
             "pre_ticket": pre_sync_ticket,
             "post_ticket": post_sync_ticket,
-            "pre_comments": pre_sync_comments,
-            "post_comments": post_sync_comments,
+            "pre_comments": get_lazy_comments(post_sync_ticket, pre_comment_ids),
+            "post_comments": get_lazy_comments(post_sync_ticket, post_comment_ids),
+            "pre_comment_ids": pre_comment_ids,
+            "post_comment_ids": post_comment_ids,
+            "changes": result.changes,
         }
 
-        if created and not post_sync_comments:
+        if created and not post_comment_ids:
             signals.ticket_created.send(
                 sender=models.Ticket, ticket=post_sync_ticket, context=update_context
             )
@@ -419,10 +1073,33 @@ class ZengoProcessor(object):
             signals.ticket_updated.send(
                 sender=models.Ticket,
                 ticket=post_sync_ticket,
-                updates=self.get_updates(**update_context),
+                updates=self.get_sync_updates(result.changes, update_context),
                 context=update_context,
             )
 
+    def get_sync_updates(self, changes, update_context):
+        """
+        Get new comments and updated fields as reported by the sync itself.
+
+        Should `get_updates`, `get_new_comments` or `get_updated_fields` be
+        overridden, they are instead used, being passed the ticket and its
+        comments before and after the sync.
+        """
+        if not any(
+            getattr(type(self), name) is not getattr(ZengoProcessor, name)
+            for name in ("get_updates", "get_new_comments", "get_updated_fields")
+        ):
+            return {
+                "new_comments": list(changes.new_comments),
+                "updated_fields": dict(changes.updated_fields),
+            }
+        return self.get_updates(
+            pre_ticket=update_context["pre_ticket"],
+            post_ticket=update_context["post_ticket"],
+            pre_comments=update_context["pre_comments"],
+            post_comments=update_context["post_comments"],
+        )
+
     def get_updates(self, **kwargs):
         """
         Get new comments and updated fields and custom fields.
@@ -460,14 +1137,113 @@ class ZengoProcessor(object):
                 # don't bother detecting changes in these, it's not useful
                 # and timestamps are often mismatched as datetimes and strings
                 continue
+            if k in SYNC_STATE_FIELDS:
+                # these change with the ticket, but aren't of the ticket
+                continue
             if pre_fields.get(k) != post_fields.get(k):
                 updates[k] = {"old": pre_fields.get(k), "new": post_fields.get(k)}
         return updates
 
     @contextlib.contextmanager
     def acquire_ticket_lock(self, ticket_id):
-        # subclass to serialize ticket updates
-        yield
+        # configure a lock from `zengo.locks`, or subclass to serialize ticket updates
+        lock = get_ticket_lock()
+        if lock is None:
+            yield
+        else:
+            with lock(ticket_id):
+                yield
+
+
+class QueuedZengoProcessor(ZengoProcessor):
+    """
+    Acknowledge Zendesk as soon as an event is stored, leaving processing to
+    queue workers run using `manage.py zengo_worker`.
+
+    Stored events form a durable, database-backed queue; workers claim the
+    oldest pending event using a conditional update, so any number may run
+    concurrently against the same database.
+
+    With `ZENGO_COALESCE_WINDOW` set, events are only claimed once that many
+    seconds old, and other pending events for the same ticket arriving within
+    the window are merged into the claimed one, costing a single sync.
+    """
+
+    def begin_processing_event(self, event):
+        # the event is already stored as pending, so a worker will pick it up
+        return event
+
+    def begin_processing_events(self, events):
+        # nor is there need of a service to share between the events
+        return events
+
+    def get_claimable_events(self):
+        stale = timezone.now() - timedelta(seconds=app_settings.QUEUE_CLAIM_TIMEOUT)
+        # debounce, giving bursts of events for a ticket time to be coalesced
+        debounced = timezone.now() - timedelta(seconds=app_settings.COALESCE_WINDOW)
+        pending = Q(state=models.Event.states.pending, created_at__lte=debounced)
+        # also reclaim events whose worker appears to have died
+        abandoned = Q(state=models.Event.states.processing, claimed_at__lt=stale)
+        return (
+            models.Event.objects.filter(pending | abandoned)
+            .exclude(remote_ticket_id__isnull=True)
+            .order_by("created_at", "id")
+            .values_list("id", "state", "claimed_at")
+        )
+
+    def claim_event(self):
+        """Claim the next event to be processed, returning None if there are none."""
+        # consider several candidates so concurrent workers rarely contend
+        for event_id, state, claimed_at in self.get_claimable_events()[:10]:
+            now = timezone.now()
+            claimed = models.Event.objects.filter(
+                id=event_id, state=state, claimed_at=claimed_at
+            ).update(
+                state=models.Event.states.processing, claimed_at=now, updated_at=now
+            )
+            if claimed:
+                event = models.Event.objects.get(id=event_id)
+                self.merge_pending_events(event)
+                return event
+        return None
+
+    def merge_pending_events(self, event):
+        """
+        Mark pending events for the same ticket created within the coalescing
+        window of `event` as merged into it, as its sync will cover them.
+        """
+        if not app_settings.COALESCE_WINDOW:
+            return 0
+        window_end = event.created_at + timedelta(seconds=app_settings.COALESCE_WINDOW)
+        merged = (
+            models.Event.objects.filter(
+                remote_ticket_id=event.remote_ticket_id,
+                state=models.Event.states.pending,
+                created_at__lte=window_end,
+            )
+            .exclude(id=event.id)
+            .update(
+                state=models.Event.states.merged,
+                merged_into=event,
+                updated_at=timezone.now(),
+            )
+        )
+        if merged:
+            logger.debug(
+                "Coalesced Zendesk events",
+                extra=dict(event_id=event.id, merged=merged),
+            )
+        return merged
+
+    def process_next_event(self):
+        """
+        Claim and process the next event, returning it, or None if the queue is
+        empty. Processing errors are recorded against the event and re-raised.
+        """
+        event = self.claim_event()
+        if event is not None:
+            self.process_event_and_record_errors(event)
+        return event
 
 
 def get_processor():
@@ -484,6 +1260,15 @@ def get_service():
     return import_attribute(cls)()
 
 
+def get_ticket_lock():
+    cls = app_settings.TICKET_LOCK_CLASS
+    if cls is None:
+        return None
+    return import_attribute(cls)()
+
+
+# paths are resolved once, rather than on every request
+@functools.lru_cache(maxsize=None)
 def import_attribute(path):
     assert isinstance(path, str)
     pkg, attr = path.rsplit(".", 1)
@@ -4,7 +4,67 @@ from __future__ import absolute_import
 from django.conf import settings
 
 
-DEFAULTS = {"SERVICE_CLASS": None, "WEBHOOK_SECRET": None, "PROCESSOR_CLASS": None}
+DEFAULTS = {
+    "SERVICE_CLASS": None,
+    "WEBHOOK_SECRET": None,
+    "PROCESSOR_CLASS": None,
+    # maximum size in bytes of a webhook request body, or None for no limit
+    "WEBHOOK_MAX_BODY_SIZE": 1024 * 256,
+    # maximum number of ticket IDs in a webhook batch, or None for no limit
+    "WEBHOOK_MAX_BATCH_SIZE": 100,
+    # maximum number of rows written per statement when bulk syncing
+    "UPSERT_BATCH_SIZE": 500,
+    # only fetch comments newer than those already sync'd for a ticket
+    "INCREMENTAL_COMMENT_SYNC": False,
+    # seconds after which an incremental sync fetches all comments again
+    "COMMENT_RECONCILE_INTERVAL": 60 * 60 * 24,
+    # maximum number of pooled connections kept open to Zendesk
+    "CLIENT_POOL_SIZE": 10,
+    # reuse connections between requests and probe idle ones to keep them open
+    "CLIENT_KEEP_ALIVE": True,
+    # number of threads `zengo_worker` processes queued events with
+    "WORKER_CONCURRENCY": 1,
+    # seconds an idle worker waits before checking the queue again
+    "WORKER_POLL_INTERVAL": 1,
+    # seconds after which an event claimed by a worker may be claimed again
+    "QUEUE_CLAIM_TIMEOUT": 60 * 10,
+    # seconds within which queued events for the same ticket are coalesced
+    "COALESCE_WINDOW": 0,
+    # dotted path to a lock class serializing processing per ticket
+    "TICKET_LOCK_CLASS": None,
+    # seconds to wait for a ticket lock before failing the event
+    "TICKET_LOCK_TIMEOUT": 30,
+    # seconds after which a cache lock is released should its holder die
+    "TICKET_LOCK_EXPIRY": 60 * 5,
+    # cache alias used by the cache lock
+    "TICKET_LOCK_CACHE": "default",
+    # attempts at processing an event after which it is no longer retried
+    "RETRY_MAX_ATTEMPTS": 5,
+    # seconds before a failed event is first retried, doubling per attempt
+    "RETRY_BACKOFF": 60,
+    # maximum seconds between retries of a failed event
+    "RETRY_BACKOFF_MAX": 60 * 60 * 6,
+    # days processed events are kept for by `zengo_prune_events`
+    "EVENT_RETENTION_DAYS": 30,
+    # days failed events are kept for by `zengo_prune_events`
+    "FAILED_EVENT_RETENTION_DAYS": 90,
+    # number of events deleted per statement when pruning
+    "PRUNE_BATCH_SIZE": 1000,
+    # maximum Zendesk API requests per minute made by each process, or pool
+    "RATE_LIMIT": None,
+    # requests remaining in Zendesk's rate limit window below which we slow down
+    "RATE_LIMIT_RESERVE": 10,
+    # times a rate limited request is retried before giving up
+    "RATE_LIMIT_RETRIES": 5,
+    # seconds to back off for, doubling per retry, absent a Retry-After header
+    "RATE_LIMIT_BACKOFF": 1,
+    # cache alias shared between nodes to hold back all of their requests
+    "RATE_LIMIT_CACHE": None,
+    # number of threads or processes backfills and resyncs are spread over
+    "SYNC_CONCURRENCY": 1,
+    # number of contiguous ticket IDs handed to a sync worker at a time
+    "SYNC_CHUNK_SIZE": 100,
+}
 
 
 class AppSettings(object):
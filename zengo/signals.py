@@ -9,3 +9,6 @@ ticket_created = Signal(providing_args=["ticket", "context"])
 
 # fired upon any change to a ticket beyond its initial creation
 ticket_updated = Signal(providing_args=["ticket", "updates", "context"])
+
+# fired after waiting on a ticket lock, whether or not it was acquired
+ticket_lock_waited = Signal(providing_args=["ticket_id", "wait_time", "acquired"])
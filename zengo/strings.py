@@ -1,3 +1,10 @@
 data_malformed = "No JSON object could be decoded"
 data_no_ticket_id = "`id` not found in data"
+data_no_ticket_ids = "`ids` must be a non-empty list of ticket ids"
+data_too_many_ticket_ids = "`ids` must hold no more than {} distinct ticket ids"
 secret_missing_or_wrong = "Secret missing or wrong"
+body_too_large = "Request body too large"
+httpx_missing = "httpx is required to sync asynchronously; install django-zengo[async]"
+async_ticket_lock = (
+    "Per-ticket locks aren't supported when processing events asynchronously"
+)
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import asyncio
+
 from django.core.exceptions import ValidationError
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.utils.crypto import constant_time_compare
@@ -8,11 +10,29 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import View
 
+from asgiref.sync import sync_to_async
+
 from . import strings
+from .aio import AsyncZengoProcessor
 from .service import get_processor
 from .settings import app_settings
 
 
+try:
+    from asgiref.sync import markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+
+async def ensure_awaited(response):
+    if asyncio.iscoroutine(response):
+        response = await response
+    return response
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class WebhookView(View):
     """Receive an update from Zendesk that a ticket has changed."""
@@ -28,13 +48,106 @@ class WebhookView(View):
             secret_given, self.secret
         )
 
-    def post(self, request):
+    def get_content_length(self):
+        try:
+            return int(self.request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            # as Django itself treats it
+            return 0
+
+    def body_too_large(self):
+        max_size = app_settings.WEBHOOK_MAX_BODY_SIZE
+        if max_size is None:
+            return False
+        return self.get_content_length() > max_size
+
+    def read_body(self):
+        """
+        Return the request body, or None should it exceed the size limit.
+
+        The limit is also enforced while reading, as requests needn't give
+        their length, such as when chunked, and no more than the length given
+        is read.
+        """
+        max_size = app_settings.WEBHOOK_MAX_BODY_SIZE
+        if max_size is None:
+            return self.request.body
+        length = self.get_content_length()
+        if length:
+            # already known to be within the limit
+            return self.request.read(length)
+        body = self.request.read(max_size + 1)
+        return None if len(body) > max_size else body
+
+    def reject(self):
+        """
+        Return a response refusing the request should it be too large or lack
+        the secret, checked without reading the body or touching the database.
+        """
+        if self.body_too_large():
+            return HttpResponse(strings.body_too_large, status=413)
         if not self.validate_secret():
             return HttpResponseForbidden(strings.secret_missing_or_wrong)
+        return None
+
+    def post(self, request):
+        rejection = self.reject()
+        if rejection is not None:
+            return rejection
+        body = self.read_body()
+        if body is None:
+            return HttpResponse(strings.body_too_large, status=413)
+        processor = get_processor()
+        try:
+            events = processor.store_events(body.decode("utf-8"))
+        except ValidationError as ve:
+            return HttpResponseBadRequest(ve.message)
+        processor.begin_processing_events(events)
+        return HttpResponse()
+
+
+class AsyncWebhookView(WebhookView):
+    """
+    Receive an update from Zendesk that a ticket has changed, processing it
+    without tying up a thread for the duration, when served under ASGI.
+
+    Use with `zengo.aio.AsyncZengoProcessor` and `zengo.aio.AsyncZengoService`.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Django only recognises async class-based views itself from 4.1
+        return markcoroutinefunction(super(AsyncWebhookView, cls).as_view(**initkwargs))
+
+    # every handler must be awaitable, including those `View` provides, which
+    # themselves return coroutines from Django 4.1
+
+    async def http_method_not_allowed(self, request, *args, **kwargs):
+        return await ensure_awaited(
+            super(AsyncWebhookView, self).http_method_not_allowed(
+                request, *args, **kwargs
+            )
+        )
+
+    async def options(self, request, *args, **kwargs):
+        return await ensure_awaited(
+            super(AsyncWebhookView, self).options(request, *args, **kwargs)
+        )
+
+    async def post(self, request):
+        rejection = self.reject()
+        if rejection is not None:
+            return rejection
+        body = self.read_body()
+        if body is None:
+            return HttpResponse(strings.body_too_large, status=413)
         processor = get_processor()
         try:
-            event = processor.store_event(request.body.decode("utf-8"))
+            events = await sync_to_async(processor.store_events)(body.decode("utf-8"))
         except ValidationError as ve:
             return HttpResponseBadRequest(ve.message)
-        processor.begin_processing_event(event)
+        if isinstance(processor, AsyncZengoProcessor):
+            await processor.begin_processing_events_async(events)
+        else:
+            await sync_to_async(processor.begin_processing_events)(events)
         return HttpResponse()